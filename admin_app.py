@@ -1,12 +1,31 @@
-from flask import Flask, request, jsonify, session, send_from_directory
+from flask import Flask, request, jsonify, session, send_from_directory, Response
 from flask_cors import CORS
 import sqlite3
-import hashlib
-import csv
-import io
+import json
+import math
+import queue
+import atexit
+import threading
 import logging
 from contextlib import contextmanager
 from config import Config
+from db_pool import get_pool
+from migrations import migrate
+from question_cache import exam_cache, bump_version, QUESTIONS, SETTINGS, USERS
+from passwords import hash_password, verify_password, dummy_hash
+from rate_limit import LoginLimiter
+from metrics import REGISTRY, instrument_app, add_endpoint
+from papers import generate_papers, delete_papers, count_stale_papers
+from answer_drafts import delete_drafts
+from change_log import ChangeFeed, ChangeLogPruner, latest_change_id, MAX_BACKLOG
+from leaderboard import Leaderboard, decode_cursor
+from item_analysis import ItemAnalysis, AVAILABLE as ITEM_ANALYSIS_AVAILABLE
+from regrade import Regrader
+from collusion import CollusionReport, MIN_COMMON_WRONG, MAX_PAIRS
+from exports import stream_export, FORMATS, DETAILS
+from student_import import import_students, parse_upload
+from question_bank import (question_hash, import_questions, stream_questions, ImportStopped,
+                           parse_upload as parse_question_upload, FORMATS as QUESTION_FORMATS)
 
 # Setup logging
 logging.basicConfig(
@@ -22,24 +41,84 @@ app.config['SESSION_COOKIE_HTTPONLY'] = Config.SESSION_COOKIE_HTTPONLY
 app.config['PERMANENT_SESSION_LIFETIME'] = Config.SESSION_LIFETIME
 CORS(app, supports_credentials=True, origins=['http://localhost:5001', 'http://127.0.0.1:5001'])
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+change_feed = ChangeFeed(get_pool().connection, Config.EVENT_POLL_INTERVAL, Config.MAX_EVENT_STREAMS)
+atexit.register(change_feed.stop)
+leaderboard = Leaderboard(get_pool().connection)
+analysis = ItemAnalysis(get_pool().connection)
+collusion = CollusionReport(analysis, get_pool().connection, Config.COLLUSION_WORKERS or None)
+regrader = Regrader(get_pool().connection)
+
+# Every reader of change_log lives in this process, so it is pruned from here.
+# The feed and a regrade only hold a position while active; the leaderboard
+# and item analysis must have loaded before anything is deleted
+change_log_pruner = ChangeLogPruner(get_pool().connection, Config.CHANGE_LOG_PRUNE_INTERVAL)
+change_log_pruner.register(change_feed.last_change_id)
+change_log_pruner.register(regrader.last_change_id)
+change_log_pruner.register(leaderboard.last_change_id, required=True)
+change_log_pruner.register(analysis.last_change_id, required=ITEM_ANALYSIS_AVAILABLE)
+
+_background_lock = threading.Lock()
+_background_started = False
+
+
+def start_background():
+    """Migrate the database and start the regrader and change_log pruner, once.
+
+    Called on the first request instead of at import: the Werkzeug
+    reloader's watcher process and spawned pool workers (which re-import
+    __main__) load this module as well, and must not regrade or prune.
+    """
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        # Bring older exam.db files up to the current schema
+        with get_pool().connection() as conn:
+            migrate(conn)
+        regrader.start()
+        atexit.register(regrader.stop)
+        change_log_pruner.start()
+        atexit.register(change_log_pruner.stop)
+        _background_started = True
+
+
+@app.before_request
+def ensure_background():
+    if not _background_started:
+        start_background()
+
+login_limiter = LoginLimiter(Config.MAX_LOGIN_ATTEMPTS, Config.RATE_LIMIT_WINDOW, Config.MAX_LOGIN_ATTEMPTS_PER_IP)
+
+if Config.METRICS_ENABLED:
+    instrument_app(app, 'admin')
+    add_endpoint(app, Config.METRICS_TOKEN)
+    REGISTRY.caches({'questions': lambda: (exam_cache.hits, exam_cache.misses)})
+    REGISTRY.stats('db_pool', get_pool().stats, 'Connection pool statistics')
+    REGISTRY.stats('admin_login_limits', login_limiter.stats, 'Admin login limiter statistics')
+    REGISTRY.stats('admin_live', lambda: {'event_streams': change_feed.subscriber_count(),
+                                          'leaderboard_entries': len(leaderboard)},
+                   'Admin live dashboard state')
+    REGISTRY.stats('regrade', lambda: regrader.stats, 'Regrade job statistics')
+    REGISTRY.stats('change_log', lambda: change_log_pruner.stats, 'Change log pruning statistics')
+
+RESULTS_PAGE_SIZE = 100
+MAX_RESULTS_PAGE_SIZE = 1000
+SESSIONS_PAGE_SIZE = 100
+COLLUSION_PAGE_SIZE = 100
+
+# Seconds between SSE comments that keep proxies from closing an idle stream
+EVENT_KEEPALIVE = 15
 
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(Config.DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    try:
-        for pragma, value in Config.SQLITE_PRAGMAS.items():
-            conn.execute(f'PRAGMA {pragma}={value}')
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Database error: {e}")
-        raise
-    finally:
-        conn.close()
+    with get_pool().connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Database error: {e}")
+            raise
 
 def validate_input(value, max_length=100):
     """Validate and sanitize user input"""
@@ -69,11 +148,22 @@ def admin_login():
         if not username or not password:
             return jsonify({'success': False, 'message': 'Invalid input'}), 400
         
+        wait = login_limiter.check(username, request.remote_addr)
+        if wait:
+            logger.warning(f"Rate limited admin login for username: {username} from {request.remote_addr}")
+            response = jsonify({'success': False,
+                                'message': f'Too many login attempts. Try again in {math.ceil(wait)} seconds'})
+            response.headers['Retry-After'] = str(math.ceil(wait))
+            return response, 429
+        
         with get_db() as conn:
             admin = conn.execute('SELECT * FROM users WHERE username = ? AND role = "admin"', 
                                  (username,)).fetchone()
+            # Hash an unknown username's password too, so timing does not reveal which exist
+            valid = verify_password(password, admin['password'] if admin else dummy_hash())
             
-            if admin and admin['password'] == hash_password(password):
+            if admin and valid:
+                login_limiter.succeeded(username)
                 # Regenerate session
                 session.clear()
                 session.permanent = True
@@ -83,6 +173,7 @@ def admin_login():
                 logger.info(f"Admin {username} logged in")
                 return jsonify({'success': True})
         
+        login_limiter.failed(username, request.remote_addr)
         logger.warning(f"Failed admin login attempt for username: {username}")
         return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
     except Exception as e:
@@ -129,11 +220,15 @@ def add_question():
         if correct not in ['A', 'B', 'C', 'D']:
             return jsonify({'success': False, 'message': 'Invalid answer'}), 400
         
+        content_hash = question_hash(question, option_a, option_b, option_c, option_d)
         with get_db() as conn:
+            if conn.execute('SELECT 1 FROM questions WHERE content_hash = ?', (content_hash,)).fetchone():
+                return jsonify({'success': False, 'message': 'Question already exists'}), 400
             conn.execute('''INSERT INTO questions 
-                            (question, option_a, option_b, option_c, option_d, correct_answer) 
-                            VALUES (?, ?, ?, ?, ?, ?)''',
-                         (question, option_a, option_b, option_c, option_d, correct))
+                            (question, option_a, option_b, option_c, option_d, correct_answer, content_hash) 
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         (question, option_a, option_b, option_c, option_d, correct, content_hash))
+            bump_version(conn, QUESTIONS)
         
         logger.info(f"Admin {session['admin_username']} added question")
         return jsonify({'success': True})
@@ -141,6 +236,59 @@ def add_question():
         logger.error(f"Add question error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
 
+@app.route('/api/admin/questions/import', methods=['POST'])
+@admin_required
+def import_question_bank():
+    """Bulk-add questions from an uploaded CSV or JSON/NDJSON file, skipping duplicates"""
+    try:
+        upload = request.files.get('file')
+        if upload:
+            stream = upload.stream
+            name = (upload.filename or '').lower()
+            default_format = 'json' if name.endswith(('.json', '.ndjson')) else 'csv'
+        else:
+            stream = request.stream
+            default_format = 'json' if 'json' in (request.content_type or '') else 'csv'
+        fmt = request.args.get('format', default_format)
+        
+        with get_db() as conn:
+            try:
+                report = import_questions(conn, parse_question_upload(stream, fmt))
+            except ImportStopped as e:
+                # Earlier batches stay committed; say so rather than report a clean failure
+                conn.rollback()
+                logger.warning(f"Admin {session['admin_username']} question import stopped: {e}")
+                return jsonify({'success': False, 'message': str(e),
+                                'stopped_partway': e.report['created'] > 0, **e.report}), 400
+            except ValueError as e:
+                conn.rollback()
+                return jsonify({'success': False, 'message': str(e)}), 400
+        
+        logger.info(f"Admin {session['admin_username']} imported {report['created']} questions "
+                    f"({len(report['skipped'])} skipped)")
+        return jsonify({'success': True, **report})
+    except Exception as e:
+        logger.error(f"Import questions error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
+@app.route('/api/admin/questions/export', methods=['GET'])
+@admin_required
+def export_question_bank():
+    try:
+        fmt = request.args.get('format', 'json')
+        if fmt not in QUESTION_FORMATS:
+            return jsonify({'success': False, 'message': 'Invalid input'}), 400
+        
+        logger.info(f"Admin {session['admin_username']} exported the question bank as {fmt}")
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/json'
+        return Response(stream_questions(get_pool().connection, fmt), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename=questions.{fmt}',
+            'Cache-Control': 'no-store'
+        })
+    except Exception as e:
+        logger.error(f"Export questions error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
 @app.route('/api/admin/questions/<int:qid>', methods=['PUT'])
 @admin_required
 def update_question(qid):
@@ -160,13 +308,20 @@ def update_question(qid):
             return jsonify({'success': False, 'message': 'Invalid answer'}), 400
         
         with get_db() as conn:
+            old = conn.execute('SELECT correct_answer FROM questions WHERE id = ?', (qid,)).fetchone()
             conn.execute('''UPDATE questions SET 
                             question = ?, option_a = ?, option_b = ?, 
-                            option_c = ?, option_d = ?, correct_answer = ? 
+                            option_c = ?, option_d = ?, correct_answer = ?, content_hash = ? 
                             WHERE id = ?''',
-                         (question, option_a, option_b, option_c, option_d, correct, qid))
+                         (question, option_a, option_b, option_c, option_d, correct,
+                          question_hash(question, option_a, option_b, option_c, option_d), qid))
+            bump_version(conn, QUESTIONS)
         
         logger.info(f"Admin {session['admin_username']} updated question {qid}")
+        if old and old['correct_answer'] != correct:
+            # Scores already recorded were marked against the old key
+            regrader.request([qid])
+            return jsonify({'success': True, 'regrade': regrader.status()})
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Update question error: {e}")
@@ -178,6 +333,7 @@ def delete_question(qid):
     try:
         with get_db() as conn:
             conn.execute('DELETE FROM questions WHERE id = ?', (qid,))
+            bump_version(conn, QUESTIONS)
         logger.info(f"Admin {session['admin_username']} deleted question {qid}")
         return jsonify({'success': True})
     except Exception as e:
@@ -214,6 +370,7 @@ def add_student():
             try:
                 conn.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
                              (username, hash_password(password), 'student'))
+                bump_version(conn, USERS)
                 logger.info(f"Admin {session['admin_username']} added student {username}")
                 return jsonify({'success': True})
             except sqlite3.IntegrityError:
@@ -222,12 +379,47 @@ def add_student():
         logger.error(f"Add student error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
 
+@app.route('/api/admin/students/import', methods=['POST'])
+@admin_required
+def import_student_list():
+    """Bulk-create students from an uploaded CSV or JSON/NDJSON file"""
+    try:
+        upload = request.files.get('file')
+        if upload:
+            stream = upload.stream
+            name = (upload.filename or '').lower()
+            default_format = 'json' if name.endswith(('.json', '.ndjson')) else 'csv'
+        else:
+            stream = request.stream
+            default_format = 'json' if 'json' in (request.content_type or '') else 'csv'
+        fmt = request.args.get('format', default_format)
+        
+        with get_db() as conn:
+            try:
+                report = import_students(conn, parse_upload(stream, fmt),
+                                         Config.IMPORT_HASH_WORKERS or None)
+            except ValueError as e:
+                conn.rollback()
+                return jsonify({'success': False, 'message': str(e)}), 400
+        
+        logger.info(f"Admin {session['admin_username']} imported {report['created']} students "
+                    f"({len(report['skipped'])} skipped)")
+        return jsonify({'success': True, **report})
+    except Exception as e:
+        logger.error(f"Import students error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
 @app.route('/api/admin/students/<int:sid>', methods=['DELETE'])
 @admin_required
 def delete_student(sid):
     try:
         with get_db() as conn:
             conn.execute('DELETE FROM users WHERE id = ? AND role = "student"', (sid,))
+            delete_papers(conn, sid)
+            delete_drafts(conn, sid)
+            bump_version(conn, USERS)
+        leaderboard.remove(sid)
+        analysis.remove(sid)
         logger.info(f"Admin {session['admin_username']} deleted student {sid}")
         return jsonify({'success': True})
     except Exception as e:
@@ -263,6 +455,7 @@ def update_settings():
         with get_db() as conn:
             conn.execute('UPDATE exam_settings SET duration_minutes = ?, questions_per_exam = ? WHERE id = 1',
                          (duration, questions))
+            bump_version(conn, SETTINGS)
         
         logger.info(f"Admin {session['admin_username']} updated settings")
         return jsonify({'success': True})
@@ -270,61 +463,142 @@ def update_settings():
         logger.error(f"Update settings error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
 
+# Pre-generated Papers
+@app.route('/api/admin/papers', methods=['GET'])
+@admin_required
+def get_papers():
+    try:
+        with get_db() as conn:
+            settings = exam_cache.get_settings(conn)
+            summary = conn.execute('''SELECT COUNT(*) as total, MAX(seed) as seed, MAX(created_at) as created_at
+                                       FROM exam_papers''').fetchone()
+            stale = count_stale_papers(conn, settings.questions_per_exam)
+        return jsonify({
+            'success': True,
+            'papers': {
+                'total': summary['total'],
+                'stale': stale,
+                'seed': summary['seed'],
+                'created_at': summary['created_at']
+            }
+        })
+    except Exception as e:
+        logger.error(f"Get papers error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
+@app.route('/api/admin/papers/generate', methods=['POST'])
+@admin_required
+def generate_exam_papers():
+    try:
+        data = request.json or {}
+        seed = data.get('seed')
+        seed = int(seed) if seed not in (None, '') else None
+        stratified = bool(data.get('stratified', False))
+        overwrite = bool(data.get('overwrite', False))
+        
+        with get_db() as conn:
+            bank = exam_cache.get_bank(conn)
+            settings = exam_cache.get_settings(conn)
+            try:
+                generated, seed = generate_papers(conn, bank, settings.questions_per_exam,
+                                                  seed=seed, stratified=stratified, overwrite=overwrite)
+            except ValueError as e:
+                conn.rollback()
+                return jsonify({'success': False, 'message': str(e)}), 400
+        
+        logger.info(f"Admin {session['admin_username']} generated {generated} papers (seed {seed})")
+        return jsonify({'success': True, 'generated': generated, 'seed': seed})
+    except Exception as e:
+        logger.error(f"Generate papers error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
+@app.route('/api/admin/papers', methods=['DELETE'])
+@admin_required
+def clear_papers():
+    try:
+        with get_db() as conn:
+            delete_papers(conn)
+        logger.info(f"Admin {session['admin_username']} cleared pre-generated papers")
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"Clear papers error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
 # Results Management
 @app.route('/api/admin/results', methods=['GET'])
 @admin_required
 def get_results():
+    """Keyset-paginated leaderboard; pass next_cursor back as ?after= for the next page"""
     try:
-        with get_db() as conn:
-            results = conn.execute('''SELECT u.username, r.ip_address, r.score, r.total_questions, r.submitted_at 
-                                      FROM results r 
-                                      JOIN users u ON r.user_id = u.id 
-                                      ORDER BY r.score DESC, r.submitted_at ASC''').fetchall()
+        args = request.args
+        try:
+            after = decode_cursor(args['after']) if args.get('after') else None
+            limit = min(max(int(args.get('limit', RESULTS_PAGE_SIZE)), 1), MAX_RESULTS_PAGE_SIZE)
+            min_score = int(args['min_score']) if args.get('min_score') else None
+            max_score = int(args['max_score']) if args.get('max_score') else None
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid input'}), 400
+        
+        results, next_cursor = leaderboard.page(after=after, limit=limit,
+                                                min_score=min_score, max_score=max_score,
+                                                since=args.get('since') or None,
+                                                until=args.get('until') or None,
+                                                username_prefix=validate_input(args.get('username'), 50))
+        for r in results:
+            del r['user_id']
         return jsonify({
             'success': True,
-            'results': [dict(r) for r in results]
+            'results': results,
+            'next_cursor': next_cursor,
+            'total': len(leaderboard)
         })
     except Exception as e:
         logger.error(f"Get results error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
 
+@app.route('/api/admin/results/rank', methods=['GET'])
+@admin_required
+def get_result_rank():
+    try:
+        username = validate_input(request.args.get('username'), 50)
+        if not username:
+            return jsonify({'success': False, 'message': 'Invalid input'}), 400
+        
+        found = leaderboard.rank(username)
+        if found is None:
+            return jsonify({'success': False, 'message': 'No result for this student'}), 404
+        rank, entry = found
+        result = entry._asdict()
+        del result['user_id']
+        return jsonify({'success': True, 'rank': rank, 'total': len(leaderboard), 'result': result})
+    except Exception as e:
+        logger.error(f"Get result rank error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
 @app.route('/api/admin/results/export', methods=['GET'])
 @admin_required
 def export_results():
+    """Stream results as CSV or NDJSON (?format=), optionally per answer (?detail=answers)"""
     try:
-        with get_db() as conn:
-            results = conn.execute('''SELECT u.username, r.ip_address, r.score, r.total_questions, 
-                                      ROUND(r.score * 100.0 / r.total_questions, 2) as percentage,
-                                      r.submitted_at 
-                                      FROM results r 
-                                      JOIN users u ON r.user_id = u.id 
-                                      ORDER BY r.score DESC, r.submitted_at ASC''').fetchall()
-            
-            tab_switches = conn.execute('''SELECT u.username, t.ip_address, MAX(t.switch_count) as max_switches
-                                           FROM tab_switches t
-                                           JOIN users u ON t.user_id = u.id
-                                           GROUP BY u.username, t.ip_address
-                                           ORDER BY max_switches DESC''').fetchall()
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Rank', 'Username', 'IP Address', 'Score', 'Total Questions', 'Percentage', 'Submitted At'])
-        
-        for idx, r in enumerate(results, 1):
-            writer.writerow([idx, r['username'], r['ip_address'], r['score'], r['total_questions'], 
-                            f"{r['percentage']}%", r['submitted_at']])
-        
-        writer.writerow([])
-        writer.writerow(['TAB SWITCHES'])
-        writer.writerow(['Username', 'IP Address', 'Max Switches'])
-        for t in tab_switches:
-            writer.writerow([t['username'], t['ip_address'], t['max_switches']])
+        fmt = request.args.get('format', 'csv')
+        detail = request.args.get('detail', 'summary')
+        if fmt not in FORMATS or detail not in DETAILS:
+            return jsonify({'success': False, 'message': 'Invalid input'}), 400
         
-        logger.info(f"Admin {session['admin_username']} exported results")
-        return output.getvalue(), 200, {
-            'Content-Type': 'text/csv',
-            'Content-Disposition': 'attachment; filename=exam_results.csv'
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+        filename = 'exam_results' if detail == 'summary' else 'exam_answers'
+        headers = {
+            'Content-Disposition': f'attachment; filename={filename}.{fmt}',
+            'Cache-Control': 'no-store',
+            'Vary': 'Accept-Encoding'
         }
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+        
+        logger.info(f"Admin {session['admin_username']} exported {detail} as {fmt}")
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        return Response(stream_export(get_pool().connection, fmt, detail, compress),
+                        mimetype=mimetype, headers=headers)
     except Exception as e:
         logger.error(f"Export results error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
@@ -348,26 +622,171 @@ def get_tab_switches():
         logger.error(f"Get tab switches error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
 
+@app.route('/api/admin/regrade', methods=['GET'])
+@admin_required
+def get_regrade_status():
+    """Progress of the current (or last) regrade after an answer key edit"""
+    return jsonify({'success': True, **regrader.status()})
+
+@app.route('/api/admin/analysis', methods=['GET'])
+@admin_required
+def get_item_analysis():
+    """Difficulty, discrimination and distractor counts per question, plus KR-20"""
+    if not ITEM_ANALYSIS_AVAILABLE:
+        return jsonify({'success': False, 'message': 'Item analysis needs numpy (pip install numpy)'}), 503
+    try:
+        return jsonify({'success': True, **analysis.report()})
+    except Exception as e:
+        logger.error(f"Item analysis error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
+@app.route('/api/admin/collusion', methods=['GET'])
+@admin_required
+def get_collusion():
+    """Candidate pairs ranked by identical wrong answers per differing answer"""
+    if not ITEM_ANALYSIS_AVAILABLE:
+        return jsonify({'success': False, 'message': 'Collusion detection needs numpy (pip install numpy)'}), 503
+    try:
+        try:
+            min_wrong = max(int(request.args.get('min_wrong', MIN_COMMON_WRONG)), 1)
+            limit = min(max(int(request.args.get('limit', COLLUSION_PAGE_SIZE)), 1), MAX_PAIRS)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid input'}), 400
+        
+        return jsonify({'success': True, **collusion.report(min_wrong, limit)})
+    except Exception as e:
+        logger.error(f"Collusion report error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
 @app.route('/api/admin/sessions', methods=['GET'])
 @admin_required
 def get_sessions():
+    """Login history, newest first; pass next_before back as ?before= for the next page.
+    
+    Stale sessions are closed by the student server's sweeper, not here.
+    """
     try:
+        try:
+            before = int(request.args['before']) if request.args.get('before') else None
+            limit = min(max(int(request.args.get('limit', SESSIONS_PAGE_SIZE)), 1), MAX_RESULTS_PAGE_SIZE)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid input'}), 400
+        
+        where, params = ('WHERE s.id < ?', [before]) if before is not None else ('', [])
         with get_db() as conn:
-            # Auto-cleanup old sessions (older than 2 hours)
-            conn.execute('''UPDATE user_sessions SET is_active = 0, logout_time = datetime('now', 'localtime')
-                            WHERE is_active = 1 AND login_time < datetime('now', '-2 hours')''')
-            
-            sessions = conn.execute('''SELECT u.username, s.ip_address, s.login_time, s.logout_time, s.is_active
-                                       FROM user_sessions s
-                                       JOIN users u ON s.user_id = u.id
-                                       ORDER BY s.login_time DESC''').fetchall()
+            sessions = conn.execute(f'''SELECT s.id, u.username, s.ip_address, s.login_time, s.logout_time, s.is_active
+                                        FROM user_sessions s
+                                        JOIN users u ON s.user_id = u.id
+                                        {where}
+                                        ORDER BY s.id DESC LIMIT ?''', params + [limit + 1]).fetchall()
+            active_count = conn.execute('SELECT COUNT(*) FROM user_sessions WHERE is_active = 1').fetchone()[0]
+            total = conn.execute('SELECT COUNT(*) FROM user_sessions').fetchone()[0]
+        
+        next_before = sessions[limit - 1]['id'] if len(sessions) > limit else None
         return jsonify({
             'success': True,
-            'sessions': [dict(s) for s in sessions]
+            'sessions': [dict(s) for s in sessions[:limit]],
+            'next_before': next_before,
+            'active_count': active_count,
+            'total': total
         })
     except Exception as e:
         logger.error(f"Get sessions error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
 
+@app.route('/api/admin/sessions/online', methods=['GET'])
+@admin_required
+def get_online_sessions():
+    """Students with an unexpired session; last_seen lags by up to one sweep interval"""
+    try:
+        with get_db() as conn:
+            online = conn.execute('''SELECT u.username, w.ip_address,
+                                     datetime(w.created_at, 'unixepoch', 'localtime') AS login_time,
+                                     datetime(w.last_seen, 'unixepoch', 'localtime') AS last_seen
+                                     FROM web_sessions w
+                                     JOIN users u ON w.user_id = u.id
+                                     WHERE w.expires_at > strftime('%s', 'now')
+                                     ORDER BY w.created_at''').fetchall()
+        return jsonify({
+            'success': True,
+            'online': [dict(s) for s in online],
+            'count': len(online)
+        })
+    except Exception as e:
+        logger.error(f"Get online sessions error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
+def format_event(event_id, kind, data):
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+@app.route('/api/admin/events', methods=['GET'])
+@admin_required
+def stream_events():
+    """Server-Sent Events feed of results, sessions and tab switches"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        after_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        after_id = None
+    
+    try:
+        subscription = change_feed.subscribe(after_id)
+    except Exception as e:
+        logger.error(f"Event stream error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+    if subscription is None:
+        return jsonify({'success': False, 'message': 'Too many live dashboards open'}), 503
+    subscriber, backlog = subscription
+    
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            if len(backlog) > MAX_BACKLOG:
+                # Too far behind to replay; tell the page to reload everything
+                subscriber.last_id = backlog[-1][0]
+                yield format_event(subscriber.last_id, 'reset', {})
+            else:
+                for event_id, kind, data in backlog:
+                    subscriber.last_id = event_id
+                    yield format_event(event_id, kind, data)
+            
+            while True:
+                if subscriber.overflowed:
+                    subscriber.overflowed = False
+                    with get_db() as conn:
+                        subscriber.last_id = latest_change_id(conn)
+                    yield format_event(subscriber.last_id, 'reset', {})
+                try:
+                    changes = subscriber.queue.get(timeout=EVENT_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                for event_id, kind, data in changes:
+                    # The backlog read may already have covered the first live batch
+                    if event_id > subscriber.last_id:
+                        subscriber.last_id = event_id
+                        yield format_event(event_id, kind, data)
+        finally:
+            change_feed.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/admin/login-limits', methods=['GET'])
+@admin_required
+def get_login_limit_stats():
+    return jsonify({
+        'success': True,
+        'login_limits': login_limiter.stats()
+    })
+
+@app.route('/api/admin/db-pool', methods=['GET'])
+@admin_required
+def get_db_pool_stats():
+    return jsonify({
+        'success': True,
+        'pool': get_pool().stats()
+    })
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,205 @@
+import threading
+import logging
+from exams import load_exam
+
+logger = logging.getLogger(__name__)
+
+# Letters an autosave may record; '' clears a question
+CHOICES = ('A', 'B', 'C', 'D', '')
+
+# The users check keeps a flush that races a submit from recreating the drafts
+_UPSERT = '''INSERT INTO answer_drafts (user_id, question_id, selected_answer, seq)
+             SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE id = ? AND attempted = 0)
+             ON CONFLICT(user_id, question_id) DO UPDATE SET
+                 selected_answer = excluded.selected_answer, seq = excluded.seq
+             WHERE excluded.seq > answer_drafts.seq'''
+
+
+def delete_drafts(conn, user_id):
+    conn.execute('DELETE FROM answer_drafts WHERE user_id = ?', (user_id,))
+
+
+class AnswerDrafts:
+    """In-progress answers per user, autosaved as small deltas with coalesced flushes.
+
+    The browser numbers each autosave request and sends the questions
+    changed since the last acknowledged one. A change is applied only if
+    its sequence number is above the one already held for that question,
+    so requests arriving out of order never roll an answer back. Changes
+    are kept in memory and every flush_interval seconds the latest value
+    of each changed question is upserted into answer_drafts.
+
+    save() answers with the highest sequence number known to be on disk;
+    the browser keeps resending anything newer, so whatever it sends at
+    submit time plus the stored drafts is always the whole sheet, even if
+    the server restarted in between. State for users not seen since
+    startup is loaded from the table on first access.
+
+    With shared=True (several worker processes) saves are written through
+    and state is re-read from the table on every access.
+    """
+
+    def __init__(self, connect, flush_interval=2.0, shared=False):
+        self.connect = connect
+        self.flush_interval = flush_interval
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        self._users = {}
+        self._dirty = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {'saves': 0, 'changes': 0, 'stale': 0, 'rows_written': 0, 'flushes': 0, 'loads': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='answer-draft-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _load(self, user_id, conn=None):
+        if conn is None:
+            with self.connect() as conn:
+                return self._load(user_id, conn)
+        question_ids = load_exam(conn, user_id)
+        if question_ids is None:
+            return None
+        rows = conn.execute('SELECT question_id, selected_answer, seq FROM answer_drafts WHERE user_id = ?',
+                            (user_id,)).fetchall()
+        self.stats['loads'] += 1
+        seq = max((r[2] for r in rows), default=0)
+        return {'questions': frozenset(question_ids),
+                'answers': {r[0]: (r[2], r[1]) for r in rows},
+                'seq': seq, 'saved': seq}
+
+    def _state(self, user_id, conn=None):
+        """The user's draft state, or None if they have no exam in progress. Call without the lock held."""
+        with self._lock:
+            state = self._users.get(user_id)
+        if state is not None and not self.shared:
+            return state
+
+        loaded = self._load(user_id, conn)
+        if loaded is None:
+            return None
+        with self._lock:
+            # Saves may have arrived while loading; keep the newer value of each question
+            current = self._users.get(user_id)
+            if current is not None:
+                for qid, entry in current['answers'].items():
+                    if qid not in loaded['answers'] or entry[0] > loaded['answers'][qid][0]:
+                        loaded['answers'][qid] = entry
+                loaded['seq'] = max(loaded['seq'], current['seq'])
+                loaded['saved'] = max(loaded['saved'], current['saved'])
+            self._users[user_id] = loaded
+        return loaded
+
+    def save(self, user_id, seq, changes, conn=None):
+        """Apply {question_id: letter} changes sent with sequence number seq.
+
+        Returns the highest sequence number stored durably, or None if the
+        user has no exam in progress. Raises ValueError for a question that
+        is not on the user's exam. Pass conn when already holding a pooled
+        connection, so the pool is never asked for a second one.
+        """
+        state = self._state(user_id, conn)
+        if state is None:
+            return None
+        unknown = [qid for qid in changes if qid not in state['questions']]
+        if unknown:
+            raise ValueError(f'Question {unknown[0]} is not on this exam')
+
+        with self._lock:
+            self.stats['saves'] += 1
+            dirty = self._dirty.setdefault(user_id, {})
+            for qid, selected in changes.items():
+                current = state['answers'].get(qid)
+                if current is not None and current[0] >= seq:
+                    self.stats['stale'] += 1
+                    continue
+                state['answers'][qid] = dirty[qid] = (seq, selected)
+                self.stats['changes'] += 1
+            if not dirty:
+                del self._dirty[user_id]
+            state['seq'] = max(state['seq'], seq)
+        if self.shared:
+            self.flush_user(user_id, conn)
+        with self._lock:
+            return state['saved']
+
+    def get(self, user_id, conn=None):
+        """({question_id: letter}, highest sequence number seen) for the user, or None without an exam"""
+        state = self._state(user_id, conn)
+        if state is None:
+            return None
+        with self._lock:
+            return {qid: selected for qid, (_, selected) in state['answers'].items()}, state['seq']
+
+    def _take(self, user_id=None):
+        """Pending rows plus, per user, the sequence number they bring the table up to"""
+        with self._lock:
+            if user_id is None:
+                dirty, self._dirty = self._dirty, {}
+            elif user_id in self._dirty:
+                dirty = {user_id: self._dirty.pop(user_id)}
+            else:
+                return [], {}
+            rows = [(uid, qid, selected, seq) for uid, changes in dirty.items()
+                    for qid, (seq, selected) in changes.items()]
+            reached = {uid: self._users[uid]['seq'] for uid in dirty if uid in self._users}
+            return rows, reached
+
+    def _upsert(self, conn, rows):
+        conn.executemany(_UPSERT, ((uid, qid, selected, seq, uid) for uid, qid, selected, seq in rows))
+        conn.commit()
+
+    def _write(self, rows, reached, conn=None):
+        if not rows:
+            return
+        try:
+            if conn is None:
+                with self.connect() as conn:
+                    self._upsert(conn, rows)
+            else:
+                self._upsert(conn, rows)
+        except Exception:
+            # Put the rows back so the next flush retries them
+            with self._lock:
+                for uid, qid, selected, seq in rows:
+                    if uid not in self._users:
+                        continue
+                    changes = self._dirty.setdefault(uid, {})
+                    if qid not in changes or changes[qid][0] < seq:
+                        changes[qid] = (seq, selected)
+            raise
+        with self._lock:
+            for uid, seq in reached.items():
+                state = self._users.get(uid)
+                if state is not None:
+                    state['saved'] = max(state['saved'], seq)
+        self.stats['rows_written'] += len(rows)
+
+    def flush(self):
+        self.stats['flushes'] += 1
+        self._write(*self._take())
+
+    def flush_user(self, user_id, conn=None):
+        self._write(*self._take(user_id), conn)
+
+    def forget(self, user_id):
+        """Drop a user's state once their submission has taken over from the drafts"""
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._dirty.pop(user_id, None)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Answer draft flush error: {e}")
@@ -0,0 +1,130 @@
+import sys
+from array import array
+
+CHOICES = 'ABCD'
+_CODES = {letter: code for code, letter in enumerate(CHOICES)}
+
+# SQLite caps the number of bound parameters per statement
+LOOKUP_CHUNK = 500
+
+# Every byte value in order: instr(BYTE_TABLE, byte) - 1 is the byte's value,
+# which lets the answers view decode the blobs in plain SQL
+BYTE_TABLE = "X'" + bytes(range(256)).hex().upper() + "'"
+
+
+def _byte(blob, offset):
+    return f'(instr({BYTE_TABLE}, substr({blob}, {offset}, 1)) - 1)'
+
+
+# One row per answer, as the old answers table had, for exports and ad hoc queries
+ANSWERS_VIEW = f'''CREATE VIEW IF NOT EXISTS answers AS
+    WITH RECURSIVE positions(i) AS (
+        SELECT 0
+        UNION ALL
+        SELECT i + 1 FROM positions
+        WHERE i + 1 < (SELECT MAX(length(question_ids)) / 4 FROM answer_sheets)
+    )
+    SELECT s.user_id,
+           p.i AS position,
+           {_byte('s.question_ids', 'p.i * 4 + 1')}
+               + ({_byte('s.question_ids', 'p.i * 4 + 2')} << 8)
+               + ({_byte('s.question_ids', 'p.i * 4 + 3')} << 16)
+               + ({_byte('s.question_ids', 'p.i * 4 + 4')} << 24) AS question_id,
+           CASE WHEN ({_byte('s.answered', 'p.i / 8 + 1')} >> (p.i % 8)) & 1
+                THEN substr('{CHOICES}', (({_byte('s.choices', 'p.i / 4 + 1')} >> (2 * (p.i % 4))) & 3) + 1, 1)
+                ELSE ''
+           END AS selected_answer
+    FROM answer_sheets s
+    JOIN positions p ON p.i < length(s.question_ids) / 4'''
+
+# Keeps "DELETE FROM answers" (see the README's reset commands) working
+ANSWERS_DELETE_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS answers_delete INSTEAD OF DELETE ON answers
+    BEGIN
+        DELETE FROM answer_sheets WHERE user_id = OLD.user_id;
+    END'''
+
+
+def _ids_array(blob):
+    ids = array('i')
+    ids.frombytes(blob)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+
+def pack(answers):
+    """Blobs (question_ids, choices, answered) for an ordered list of (question_id, selected).
+
+    question_ids holds little-endian int32s, choices 2 bits per answer
+    (A-D as 0-3, four to a byte, lowest bits first) and answered 1 bit per
+    answer, clear for a blank or unrecognised choice.
+    """
+    ids = array('i', (qid for qid, _ in answers))
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    choices = bytearray((len(answers) + 3) // 4)
+    answered = bytearray((len(answers) + 7) // 8)
+    for i, (_, selected) in enumerate(answers):
+        code = _CODES.get(selected)
+        if code is not None:
+            choices[i >> 2] |= code << (2 * (i & 3))
+            answered[i >> 3] |= 1 << (i & 7)
+    return ids.tobytes(), bytes(choices), bytes(answered)
+
+
+def unpack(question_ids, choices, answered):
+    """(question_id, selected) pairs in exam order; selected is '' for a blank"""
+    return [(qid, CHOICES[(choices[i >> 2] >> (2 * (i & 3))) & 3] if (answered[i >> 3] >> (i & 7)) & 1 else '')
+            for i, qid in enumerate(_ids_array(question_ids))]
+
+
+def sheet_question_ids(question_ids):
+    """The question ids of a packed sheet, in exam order"""
+    return _ids_array(question_ids).tolist()
+
+
+def save_answers(conn, result_id, user_id, answer_rows):
+    """Store a graded submission's (user_id, question_id, selected) rows as the sheet of result_id"""
+    conn.execute('INSERT INTO answer_sheets (result_id, user_id, question_ids, choices, answered) VALUES (?, ?, ?, ?, ?)',
+                 (result_id, user_id, *pack([(qid, selected) for _, qid, selected in answer_rows])))
+
+
+# A student whose attempt was reset and who submitted again has one sheet per
+# attempt; like the leaderboard, readers use the latest
+_LATEST = 's.result_id = (SELECT MAX(l.result_id) FROM answer_sheets l WHERE l.user_id = s.user_id)'
+
+
+def read_sheets(conn, user_ids=None):
+    """Yield (user_id, question_ids, choices, answered) of each existing student's
+    latest sheet, optionally only for user_ids"""
+    if user_ids is None:
+        yield from conn.execute(f'''SELECT s.user_id, s.question_ids, s.choices, s.answered
+                                    FROM answer_sheets s
+                                    JOIN users u ON u.id = s.user_id
+                                    WHERE {_LATEST}
+                                    ORDER BY s.user_id''')
+        return
+    for i in range(0, len(user_ids), LOOKUP_CHUNK):
+        chunk = user_ids[i:i + LOOKUP_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        yield from conn.execute(f'''SELECT s.user_id, s.question_ids, s.choices, s.answered
+                                    FROM answer_sheets s
+                                    JOIN users u ON u.id = s.user_id
+                                    WHERE s.user_id IN ({placeholders}) AND {_LATEST}
+                                    ORDER BY s.user_id''', chunk)
+
+
+def read_result_sheets(conn, result_ids):
+    """Yield (result_id, question_ids, choices, answered) for the given submissions"""
+    for i in range(0, len(result_ids), LOOKUP_CHUNK):
+        chunk = result_ids[i:i + LOOKUP_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        yield from conn.execute(f'''SELECT result_id, question_ids, choices, answered FROM answer_sheets
+                                    WHERE result_id IN ({placeholders})''', chunk)
+
+
+def read_answers(conn, user_ids=None):
+    """Yield (user_id, question_id, selected) for every answer of each student's latest sheet"""
+    for user_id, question_ids, choices, answered in read_sheets(conn, user_ids):
+        for qid, selected in unpack(question_ids, choices, answered):
+            yield user_id, qid, selected
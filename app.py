@@ -1,12 +1,31 @@
 from flask import Flask, request, jsonify, session, send_from_directory
 from flask_cors import CORS
-import sqlite3
-import hashlib
+import math
 import random
 import os
 import logging
+import atexit
+from datetime import datetime
 from contextlib import contextmanager
 from config import Config
+from db_pool import get_pool
+from migrations import migrate
+from question_cache import exam_cache
+from grading import grade_answers
+from answer_sheets import save_answers
+from exams import create_exam, load_exam, delete_exam
+from papers import serialize_questions, load_paper, load_paper_payload, start_paper, paper_is_current, delete_papers
+from payload_cache import PayloadCache, payload_key
+from change_log import record_change, RESULT, LOGOUT
+from passwords import get_hasher, needs_rehash, dummy_hash
+from credentials import CredentialCache
+from session_log import SessionLog
+from session_store import SessionStore, ServerSessionInterface
+from rate_limit import LoginLimiter
+from metrics import REGISTRY, WorkerSnapshots, instrument_app, add_endpoint
+from submission_queue import SubmissionQueue
+from tab_switch_store import TabSwitchStore
+from answer_drafts import AnswerDrafts, CHOICES as DRAFT_CHOICES, delete_drafts
 
 # Setup logging
 logging.basicConfig(
@@ -20,24 +39,85 @@ app.secret_key = Config.SECRET_KEY
 app.config['PERMANENT_SESSION_LIFETIME'] = Config.SESSION_LIFETIME
 CORS(app, supports_credentials=True)
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# Bring older exam.db files up to the current schema
+with get_pool().connection() as conn:
+    migrate(conn)
+
+# Under serve.py with several workers, state other workers must see lives in SQLite
+shared = Config.WORKERS > 1
+
+submission_queue = None
+if Config.SUBMISSION_QUEUE_ENABLED:
+    submission_queue = SubmissionQueue(get_pool().connection, Config.SUBMISSION_JOURNAL_PATH,
+                                       batch_size=Config.SUBMISSION_BATCH_SIZE,
+                                       flush_interval=Config.SUBMISSION_FLUSH_INTERVAL,
+                                       worker=Config.WORKER_ID if shared else None)
+    submission_queue.start()
+    atexit.register(submission_queue.stop)
+
+tab_switch_store = TabSwitchStore(get_pool().connection, Config.TAB_SWITCH_FLUSH_INTERVAL, shared=shared)
+tab_switch_store.start()
+atexit.register(tab_switch_store.stop)
+
+answer_drafts = AnswerDrafts(get_pool().connection, Config.ANSWER_DRAFT_FLUSH_INTERVAL, shared=shared)
+answer_drafts.start()
+atexit.register(answer_drafts.stop)
+
+payload_cache = PayloadCache(Config.PAYLOAD_CACHE_SIZE)
+
+credential_cache = CredentialCache(Config.CREDENTIAL_CACHE_SIZE)
+login_limiter = LoginLimiter(Config.MAX_LOGIN_ATTEMPTS, Config.RATE_LIMIT_WINDOW, Config.MAX_LOGIN_ATTEMPTS_PER_IP,
+                             connect=get_pool().connection if shared else None)
+session_log = SessionLog(get_pool().connection, Config.SESSION_LOG_FLUSH_INTERVAL)
+session_log.start()
+atexit.register(session_log.stop)
+
+session_store = SessionStore(get_pool().connection, Config.SESSION_LIFETIME, Config.SESSION_SWEEP_INTERVAL)
+session_store.start()
+atexit.register(session_store.stop)
+
+if Config.METRICS_ENABLED:
+    metrics_snapshots = None
+    if shared:
+        metrics_snapshots = WorkerSnapshots(REGISTRY, Config.METRICS_DIR, Config.WORKER_ID,
+                                            Config.METRICS_SNAPSHOT_INTERVAL)
+        metrics_snapshots.start()
+        atexit.register(metrics_snapshots.stop)
+    instrument_app(app, 'student')
+    add_endpoint(app, Config.METRICS_TOKEN, metrics_snapshots)
+    REGISTRY.caches({
+        'questions': lambda: (exam_cache.hits, exam_cache.misses),
+        'payloads': lambda: (payload_cache.hits, payload_cache.misses),
+        'credentials': lambda: (credential_cache.stats['hits'], credential_cache.stats['misses']),
+        'sessions': lambda: (session_store.stats['hits'], session_store.stats['loads']),
+    })
+    REGISTRY.stats('db_pool', get_pool().stats, 'Connection pool statistics')
+    REGISTRY.stats('login_limits', login_limiter.stats, 'Student login limiter statistics')
+    REGISTRY.stats('session_log', lambda: session_log.stats, 'Login write-behind statistics')
+    REGISTRY.stats('session_store', lambda: session_store.stats, 'Server-side session statistics')
+    REGISTRY.stats('tab_switches', lambda: tab_switch_store.stats, 'Tab switch store statistics')
+    REGISTRY.stats('answer_drafts', lambda: answer_drafts.stats, 'Answer autosave statistics')
+    if submission_queue:
+        REGISTRY.stats('submission_queue', lambda: dict(submission_queue.stats, depth=submission_queue.depth()),
+                       'Submission queue statistics')
+
+def rate_limited(username, wait):
+    logger.warning(f"Rate limited login for username: {username} from {request.remote_addr}")
+    response = jsonify({'success': False,
+                        'message': f'Too many login attempts. Try again in {math.ceil(wait)} seconds'})
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response, 429
 
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(Config.DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    try:
-        for pragma, value in Config.SQLITE_PRAGMAS.items():
-            conn.execute(f'PRAGMA {pragma}={value}')
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Database error: {e}")
-        raise
-    finally:
-        conn.close()
+    with get_pool().connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Database error: {e}")
+            raise
 
 def get_client_ip():
     # For LAN deployment, prioritize server-detected IP (local network IP)
@@ -80,6 +160,28 @@ def validate_ip(ip):
     except (ValueError, AttributeError):
         return False
 
+# The cookie carries only a session id; sessions live in web_sessions
+app.session_interface = ServerSessionInterface(session_store, get_client_ip)
+
+def exam_payload_response(payload):
+    """Serve a cached exam body, honouring If-None-Match and Accept-Encoding"""
+    if request.if_none_match.contains(payload.etag):
+        response = app.response_class(status=304)
+    else:
+        body, encoding = payload.raw, None
+        if payload.br and 'br' in request.accept_encodings:
+            body, encoding = payload.br, 'br'
+        elif payload.gzip and 'gzip' in request.accept_encodings:
+            body, encoding = payload.gzip, 'gzip'
+        response = app.response_class(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    
+    response.set_etag(payload.etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 def validate_input(value, max_length=100):
     """Validate and sanitize user input"""
     if not value or not isinstance(value, str):
@@ -100,28 +202,47 @@ def login():
         if not username or not password:
             return jsonify({'success': False, 'message': 'Invalid input'}), 400
         
+        # Keyed on the socket address; client-supplied IP headers are easy to rotate
+        wait = login_limiter.check(username, request.remote_addr)
+        if wait:
+            return rate_limited(username, wait)
+        
         with get_db() as conn:
-            user = conn.execute('SELECT * FROM users WHERE username = ? AND role = "student"', 
-                                (username,)).fetchone()
+            user = credential_cache.lookup(conn, username)
+        
+        # Slow hashes run on the hasher's threads, with no pooled connection held.
+        # Unknown usernames pay for one too, so timing does not reveal which exist
+        if user is None:
+            get_hasher().verify(password, dummy_hash())
+        elif not credential_cache.is_verified(user, password):
+            if not get_hasher().verify(password, user.password):
+                user = None
+            else:
+                credential_cache.remember(user, password)
+                if needs_rehash(user.password):
+                    get_hasher().hash_later(password, lambda new_hash, user=user:
+                                            session_log.upgrade_password(user.user_id, user.password, new_hash))
+        
+        if user:
+            login_limiter.succeeded(username)
+            if user.attempted == 1 or (submission_queue and submission_queue.is_pending(user.user_id)):
+                logger.warning(f"User {username} attempted to login after exam completion")
+                return jsonify({'success': False, 'message': 'You have already attempted the exam'}), 403
             
-            if user and user['password'] == hash_password(password):
-                if user['attempted'] == 1:
-                    logger.warning(f"User {username} attempted to login after exam completion")
-                    return jsonify({'success': False, 'message': 'You have already attempted the exam'}), 403
-                
-                # Regenerate session
-                session.clear()
-                session['user_id'] = user['id']
-                session['username'] = user['username']
-                session.permanent = True
-                
-                # Log session
-                conn.execute('INSERT INTO user_sessions (user_id, ip_address) VALUES (?, ?)',
-                             (user['id'], get_client_ip()))
-                
-                logger.info(f"User {username} logged in from {get_client_ip()}")
-                return jsonify({'success': True})
+            # Regenerate session
+            session.clear()
+            session['user_id'] = user.user_id
+            session['username'] = user.username
+            session.permanent = True
+            
+            # Log session (written behind, batched with other logins)
+            ip_address = get_client_ip()
+            session_log.record_login(user.user_id, ip_address)
+            
+            logger.info(f"User {username} logged in from {ip_address}")
+            return jsonify({'success': True})
         
+        login_limiter.failed(username, request.remote_addr)
         logger.warning(f"Failed login attempt for username: {username}")
         return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
     except Exception as e:
@@ -138,56 +259,52 @@ def start_exam():
             # Check if already attempted
             user = conn.execute('SELECT attempted FROM users WHERE id = ?', 
                                 (session['user_id'],)).fetchone()
-            if user['attempted'] == 1:
+            if user['attempted'] == 1 or (submission_queue and submission_queue.is_pending(session['user_id'], conn)):
                 return jsonify({'success': False, 'message': 'Already attempted'}), 403
             
             # Check if exam already started
-            existing = conn.execute('SELECT question_ids FROM active_exams WHERE user_id = ?',
-                                    (session['user_id'],)).fetchone()
+            existing = load_exam(conn, session['user_id'])
+            paper = load_paper(conn, session['user_id'])
             
-            if existing:
-                # Resume existing exam
-                question_ids = existing['question_ids'].split(',')
-                questions_data = conn.execute(f'SELECT * FROM questions WHERE id IN ({existing["question_ids"]})').fetchall()
-            else:
-                # Get exam settings
-                settings = conn.execute('SELECT * FROM exam_settings WHERE id = 1').fetchone()
-                
-                # Get random questions
-                all_questions = conn.execute('SELECT * FROM questions').fetchall()
-                
-                if len(all_questions) < settings['questions_per_exam']:
+            bank = exam_cache.get_bank(conn)
+            settings = exam_cache.get_settings(conn)
+            
+            if existing is None and paper is not None and not paper_is_current(paper, bank, settings.questions_per_exam):
+                # Generated before a settings change or question deletion; draw a fresh one instead
+                logger.info(f"Discarding stale pre-generated paper for user {session['user_id']}")
+                delete_papers(conn, session['user_id'])
+                paper = None
+            
+            if existing is None and paper is not None:
+                # Open the pre-generated paper
+                start_paper(conn, session['user_id'])
+                existing = load_exam(conn, session['user_id'])
+            
+            if existing is None:
+                if len(bank) < settings.questions_per_exam:
                     return jsonify({'success': False, 'message': 'Not enough questions in database'}), 400
                 
-                selected_questions = random.sample(list(all_questions), settings['questions_per_exam'])
-                question_ids = [str(q['id']) for q in selected_questions]
+                # Get random questions
+                selected_questions = random.sample(bank.questions, settings.questions_per_exam)
+                existing = [q.id for q in selected_questions]
                 
                 # Store in database
-                conn.execute('INSERT INTO active_exams (user_id, question_ids) VALUES (?, ?)',
-                             (session['user_id'], ','.join(question_ids)))
-                questions_data = selected_questions
+                create_exam(conn, session['user_id'], existing)
             
-            questions = []
-            for q in questions_data:
-                questions.append({
-                    'id': q['id'],
-                    'question': q['question'],
-                    'options': {
-                        'A': q['option_a'],
-                        'B': q['option_b'],
-                        'C': q['option_c'],
-                        'D': q['option_d']
-                    }
-                })
+            # Resumes and shared papers are served from the already encoded payload
+            key = payload_key(existing, bank.version, settings.duration_minutes)
+            payload = payload_cache.get(key)
+            if payload is None:
+                if paper is not None and paper.bank_version == bank.version:
+                    # Paper was serialized against the current bank
+                    questions_json = load_paper_payload(conn, session['user_id'])
+                else:
+                    questions_json = serialize_questions(bank.by_id[qid] for qid in existing if qid in bank.by_id)
+                payload = payload_cache.put(key, '{"duration":%d,"questions":%s,"success":true}'
+                                            % (settings.duration_minutes, questions_json))
             
-            settings = conn.execute('SELECT * FROM exam_settings WHERE id = 1').fetchone()
             logger.info(f"User {session['user_id']} started exam")
-            
-            return jsonify({
-                'success': True,
-                'questions': questions,
-                'duration': settings['duration_minutes']
-            })
+            return exam_payload_response(payload)
     except Exception as e:
         logger.error(f"Exam start error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
@@ -197,16 +314,19 @@ def submit_exam():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
+    if submission_queue and submission_queue.is_pending(session['user_id']):
+        return jsonify({'success': False, 'message': 'Already attempted'}), 403
+    
     try:
         data = request.json
         answers = data.get('answers', {})
+        draft_seq = data.get('seq')
         
         with get_db() as conn:
             # Get exam questions from database
-            active_exam = conn.execute('SELECT question_ids FROM active_exams WHERE user_id = ?',
-                                       (session['user_id'],)).fetchone()
+            question_ids = load_exam(conn, session['user_id'])
             
-            if not active_exam:
+            if question_ids is None:
                 return jsonify({'success': False, 'message': 'Exam not started'}), 400
             
             # Double-check if already attempted
@@ -215,61 +335,143 @@ def submit_exam():
             if user['attempted'] == 1:
                 return jsonify({'success': False, 'message': 'Already attempted'}), 403
             
-            # Calculate score
-            score = 0
-            question_ids = active_exam['question_ids'].split(',')
+            if draft_seq is not None:
+                # Autosaving clients send only what has not reached the server
+                # yet; finalize from the saved drafts with those changes applied
+                changes = parse_draft_changes(answers)
+                if changes is None or not isinstance(draft_seq, int):
+                    return jsonify({'success': False, 'message': 'Invalid answers'}), 400
+                try:
+                    answer_drafts.save(session['user_id'], draft_seq, changes, conn)
+                except ValueError as e:
+                    return jsonify({'success': False, 'message': str(e)}), 400
+                saved, _ = answer_drafts.get(session['user_id'], conn)
+                answers = {str(qid): selected for qid, selected in saved.items()}
             
-            for qid in question_ids:
-                question = conn.execute('SELECT correct_answer FROM questions WHERE id = ?', 
-                                        (int(qid),)).fetchone()
-                selected = answers.get(qid, '')
-                
-                # Save answer
-                conn.execute('INSERT INTO answers (user_id, question_id, selected_answer) VALUES (?, ?, ?)',
-                             (session['user_id'], int(qid), selected))
-                
-                if selected == question['correct_answer']:
-                    score += 1
+            # Get tab switch penalty, writing any not yet flushed count to the audit trail
+            max_switches = tab_switch_store.get(session['user_id'], conn)
+            tab_switch_store.flush_user(session['user_id'], conn)
             
-            # Get tab switch penalty
-            tab_switches = conn.execute('SELECT MAX(switch_count) FROM tab_switches WHERE user_id = ?',
-                                        (session['user_id'],)).fetchone()
-            max_switches = tab_switches[0] if tab_switches[0] else 0
+            # Calculate score in memory against the cached answer key
+            bank = exam_cache.get_bank(conn)
+            grade = grade_answers(session['user_id'], question_ids, answers, bank.answer_key, max_switches)
+            score, penalty, final_score = grade.score, grade.penalty, grade.final_score
             
-            # Apply penalty: subtract 1 mark for each tab switch after 2
-            penalty = max(0, max_switches - 2)
-            final_score = max(0, score - penalty)
-            
-            # Save result
-            conn.execute('INSERT INTO results (user_id, ip_address, score, total_questions) VALUES (?, ?, ?, ?)',
-                         (session['user_id'], get_client_ip(), final_score, len(question_ids)))
-            
-            # Mark as attempted
-            conn.execute('UPDATE users SET attempted = 1 WHERE id = ?', (session['user_id'],))
-            
-            # Delete active exam
-            conn.execute('DELETE FROM active_exams WHERE user_id = ?', (session['user_id'],))
-            
-            logger.info(f"User {session['user_id']} submitted exam. Score: {score}, Penalty: {penalty}, Final: {final_score}")
-            
-            return jsonify({
+            response = {
                 'success': True,
                 'score': final_score,
-                'total': len(question_ids),
+                'total': grade.total,
                 'penalty': penalty,
                 'original_score': score
-            })
+            }
+            
+            if submission_queue:
+                # Acknowledge once journaled; the writer thread records it shortly
+                receipt = submission_queue.submit(session['user_id'], get_client_ip(), grade, conn)
+                if receipt is None:
+                    return jsonify({'success': False, 'message': 'Already attempted'}), 403
+                response['receipt'] = receipt
+            else:
+                # Write everything in one short transaction; the conditional update
+                # stops a concurrent duplicate submit from recording twice
+                conn.execute('BEGIN IMMEDIATE')
+                marked = conn.execute('UPDATE users SET attempted = 1 WHERE id = ? AND attempted = 0',
+                                      (session['user_id'],)).rowcount
+                if not marked:
+                    conn.rollback()
+                    return jsonify({'success': False, 'message': 'Already attempted'}), 403
+                
+                submitted_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                result_id = conn.execute('''INSERT INTO results (user_id, ip_address, score, total_questions, submitted_at)
+                                             VALUES (?, ?, ?, ?, ?)''',
+                                         (session['user_id'], get_client_ip(), final_score, grade.total,
+                                          submitted_at)).lastrowid
+                save_answers(conn, result_id, session['user_id'], grade.answer_rows)
+                record_change(conn, RESULT, session['user_id'], ip_address=get_client_ip(),
+                              score=final_score, total_questions=grade.total, submitted_at=submitted_at)
+                delete_drafts(conn, session['user_id'])
+                delete_exam(conn, session['user_id'])
+            
+            tab_switch_store.forget(session['user_id'])
+            answer_drafts.forget(session['user_id'])
+            logger.info(f"User {session['user_id']} submitted exam. Score: {score}, Penalty: {penalty}, Final: {final_score}")
+        
+        credential_cache.mark_attempted(session.get('username'))
+        return jsonify(response)
     except Exception as e:
         logger.error(f"Exam submission error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
 
+def parse_draft_changes(answers):
+    """{question_id: letter} from an autosave body's answers, or None if malformed"""
+    if not isinstance(answers, dict):
+        return None
+    try:
+        changes = {int(qid): selected for qid, selected in answers.items()}
+    except (TypeError, ValueError):
+        return None
+    if any(selected not in DRAFT_CHOICES for selected in changes.values()):
+        return None
+    return changes
+
+@app.route('/api/exam/autosave', methods=['POST'])
+def autosave_answers():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    if submission_queue and submission_queue.is_pending(session['user_id']):
+        return jsonify({'success': False, 'message': 'Already attempted'}), 403
+    
+    try:
+        data = request.json or {}
+        try:
+            seq = int(data.get('seq'))
+        except (TypeError, ValueError):
+            seq = 0
+        changes = parse_draft_changes(data.get('answers', {}))
+        if seq < 1 or changes is None:
+            return jsonify({'success': False, 'message': 'Invalid autosave'}), 400
+        
+        try:
+            saved = answer_drafts.save(session['user_id'], seq, changes)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if saved is None:
+            return jsonify({'success': False, 'message': 'Exam not started'}), 400
+        
+        return jsonify({'success': True, 'saved': saved})
+    except Exception as e:
+        logger.error(f"Autosave error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
+@app.route('/api/exam/autosave', methods=['GET'])
+def get_autosaved_answers():
+    """Answers saved so far, for a resumed exam (the start payload is shared and cached)"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    try:
+        drafts = answer_drafts.get(session['user_id'])
+        if drafts is None:
+            return jsonify({'success': False, 'message': 'Exam not started'}), 400
+        saved, seq = drafts
+        return jsonify({'success': True, 'seq': seq,
+                        'answers': {str(qid): selected for qid, selected in saved.items() if selected}})
+    except Exception as e:
+        logger.error(f"Autosave restore error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
 @app.route('/api/logout', methods=['POST'])
 def logout():
     try:
         if 'user_id' in session:
+            # The login row may still be buffered; it must exist before it can be closed
+            session_log.flush_user(session['user_id'])
             with get_db() as conn:
-                conn.execute('''UPDATE user_sessions SET logout_time = datetime('now', 'localtime'), is_active = 0 
-                                WHERE user_id = ? AND is_active = 1''', (session['user_id'],))
+                closed = conn.execute('''UPDATE user_sessions SET logout_time = datetime('now', 'localtime'), is_active = 0 
+                                         WHERE user_id = ? AND is_active = 1''', (session['user_id'],)).rowcount
+                if closed:
+                    record_change(conn, LOGOUT, session['user_id'])
             logger.info(f"User {session['user_id']} logged out")
         session.clear()
         return jsonify({'success': True})
@@ -285,11 +487,9 @@ def log_tab_switch():
     
     try:
         data = request.json
-        count = data.get('count', 1)
+        count = int(data.get('count', 1))
         
-        with get_db() as conn:
-            conn.execute('INSERT INTO tab_switches (user_id, ip_address, switch_count) VALUES (?, ?, ?)',
-                         (session['user_id'], get_client_ip(), count))
+        tab_switch_store.record(session['user_id'], get_client_ip(), count)
         
         logger.warning(f"Tab switch detected: User {session['user_id']}, Count: {count}")
         return jsonify({'success': True})
@@ -303,10 +503,7 @@ def get_tab_switch_count():
         return jsonify({'count': 0})
     
     try:
-        with get_db() as conn:
-            result = conn.execute('SELECT MAX(switch_count) FROM tab_switches WHERE user_id = ?',
-                                  (session['user_id'],)).fetchone()
-        return jsonify({'count': result[0] if result[0] else 0})
+        return jsonify({'count': tab_switch_store.get(session['user_id'])})
     except Exception as e:
         logger.error(f"Tab switch count error: {e}")
         return jsonify({'count': 0})
@@ -0,0 +1,223 @@
+import json
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+RESULT = 'result'
+SESSION = 'session'
+LOGOUT = 'logout'
+TAB_SWITCH = 'tab_switch'
+
+# A client further behind than this is told to reload instead of replaying
+MAX_BACKLOG = 500
+# Rows deleted per pruning transaction, so the writer lock is held only briefly
+PRUNE_BATCH = 5000
+
+
+def record_change(conn, kind, user_id, **data):
+    """Append an event for the admin live feed; call inside the writing transaction"""
+    conn.execute('INSERT INTO change_log (kind, user_id, payload) VALUES (?, ?, ?)',
+                 (kind, user_id, json.dumps(data, separators=(',', ':'))))
+
+
+def record_changes(conn, kind, rows):
+    """Bulk version of record_change for (user_id, data) pairs"""
+    conn.executemany('INSERT INTO change_log (kind, user_id, payload) VALUES (?, ?, ?)',
+                     ((kind, user_id, json.dumps(data, separators=(',', ':'))) for user_id, data in rows))
+
+
+def latest_change_id(conn):
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM change_log').fetchone()[0]
+
+
+def oldest_change_id(conn):
+    return conn.execute('SELECT COALESCE(MIN(id), 0) FROM change_log').fetchone()[0]
+
+
+def prune_changes(conn, below_id, batch=PRUNE_BATCH):
+    """Delete change_log rows with id < below_id a batch at a time; returns how many went"""
+    deleted = 0
+    while True:
+        count = conn.execute('''DELETE FROM change_log WHERE id IN
+                                (SELECT id FROM change_log WHERE id < ? ORDER BY id LIMIT ?)''',
+                             (below_id, batch)).rowcount
+        conn.commit()
+        deleted += count
+        if count < batch:
+            return deleted
+
+
+def read_changes(conn, after_id, limit=MAX_BACKLOG):
+    rows = conn.execute('''SELECT c.id, c.kind, c.payload, c.created_at, u.username
+                           FROM change_log c
+                           LEFT JOIN users u ON u.id = c.user_id
+                           WHERE c.id > ?
+                           ORDER BY c.id
+                           LIMIT ?''', (after_id, limit)).fetchall()
+    changes = []
+    for r in rows:
+        data = json.loads(r['payload'])
+        data['username'] = r['username']
+        data.setdefault('at', r['created_at'])
+        changes.append((r['id'], r['kind'], data))
+    return changes
+
+
+class Subscriber:
+    def __init__(self, last_id):
+        self.last_id = last_id
+        self.queue = queue.Queue(maxsize=MAX_BACKLOG)
+        self.overflowed = False
+
+    def push(self, changes):
+        try:
+            self.queue.put_nowait(changes)
+        except queue.Full:
+            self.overflowed = True
+
+
+class ChangeFeed:
+    """Fans the change log out to every open dashboard stream.
+
+    One background thread tails change_log by primary key, so the database
+    sees one small range read per poll interval however many proctors are
+    watching. Each stream holds a waitress thread, hence max_subscribers.
+    """
+
+    def __init__(self, connect, poll_interval=1.0, max_subscribers=4):
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.max_subscribers = max_subscribers
+
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._last_id = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, after_id=None):
+        """Register a stream; returns (subscriber, backlog) or None when full"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+
+            with self.connect() as conn:
+                latest = latest_change_id(conn)
+                if after_id is None or after_id > latest:
+                    after_id = latest
+                backlog = read_changes(conn, after_id, MAX_BACKLOG + 1)
+                # The rows after a reconnecting stream's id were pruned: it must reload
+                missed = after_id < oldest_change_id(conn) - 1
+
+            if self._thread is None:
+                # Tail from here; anything newer than the backlog read is pushed live
+                self._last_id = latest
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+
+            subscriber = Subscriber(after_id)
+            if missed:
+                subscriber.overflowed = True
+                backlog = []
+            self._subscribers.add(subscriber)
+        return subscriber, backlog
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def last_change_id(self):
+        """Lowest change_log id the feed or an open stream has reached, or None when idle"""
+        with self._lock:
+            positions = [subscriber.last_id for subscriber in self._subscribers]
+            if self._thread is not None:
+                positions.append(self._last_id)
+        return min(positions, default=None)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.connect() as conn:
+                    changes = read_changes(conn, self._last_id)
+                if changes:
+                    self._last_id = changes[-1][0]
+                    with self._lock:
+                        for subscriber in self._subscribers:
+                            subscriber.push(changes)
+            except Exception as e:
+                logger.error(f"Change feed error: {e}")
+            self._stop.wait(self.poll_interval)
+
+
+class ChangeLogPruner:
+    """Deletes change_log rows that every reader has already applied.
+
+    Readers (the live feed, leaderboard, item analysis, a running regrade)
+    are registered as callables returning the last id they have applied.
+    An optional reader returns None while idle and then places no limit; a
+    required one returns None until its first load, and nothing is pruned
+    before then, since a position that is not known yet cannot be treated
+    as caught up. Every interval, rows more than `keep` below the lowest
+    position are deleted; the margin lets a reloading dashboard replay its
+    recent events and covers a reader that registers its position just
+    after a prune read the others.
+    """
+
+    def __init__(self, connect, interval=60.0, keep=MAX_BACKLOG):
+        self.connect = connect
+        self.interval = interval
+        self.keep = keep
+
+        self._readers = []
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {'prunes': 0, 'deleted': 0, 'skipped': 0}
+
+    def register(self, position, required=False):
+        self._readers.append((position, required))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='change-log-pruner', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def prune(self):
+        positions = []
+        for position, required in self._readers:
+            last_id = position()
+            if last_id is not None:
+                positions.append(last_id)
+            elif required:
+                self.stats['skipped'] += 1
+                return 0
+        with self.connect() as conn:
+            below = min(positions + [latest_change_id(conn)]) - self.keep
+            deleted = prune_changes(conn, below) if below > 0 else 0
+        self.stats['prunes'] += 1
+        self.stats['deleted'] += deleted
+        if deleted:
+            logger.info(f"Pruned {deleted} change log rows below id {below}")
+        return deleted
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.prune()
+            except Exception as e:
+                logger.error(f"Change log prune error: {e}")
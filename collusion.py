@@ -0,0 +1,194 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from item_analysis import AVAILABLE, CODES, np
+from answer_sheets import LOOKUP_CHUNK
+
+CHOICE_COUNT = len(CODES)
+
+# Pairs need at least this many identical wrong answers to be reported
+MIN_COMMON_WRONG = 3
+# Identical wrong answers per differing answer at which a pair is flagged
+# (the Harpp-Hogan EEIC/D criterion)
+FLAG_RATIO = 1.0
+# Candidates compared per task: a block of rows against every later row
+BLOCK_SIZE = 256
+# Most pairs kept for the report, best first
+MAX_PAIRS = 1000
+# Below this many candidates, starting worker processes (each spawned
+# interpreter imports numpy afresh) costs more than it saves
+PARALLEL_MIN = 2000
+
+_worker_state = None
+
+
+def answer_matrix(users, questions, choices, answer_key):
+    """Dense candidates x questions matrix of choice codes, -1 where a
+    question was not on the paper, left blank or has since been deleted,
+    plus the correct code per column and the user id per row"""
+    user_ids, u = np.unique(users, return_inverse=True)
+    question_ids, q = np.unique(questions, return_inverse=True)
+    key = np.array([CODES.get(answer_key.get(int(qid)), -1) for qid in question_ids], dtype=np.int8)
+    codes = np.full((len(user_ids), len(question_ids)), -1, dtype=np.int8)
+    codes[u, q] = np.where(choices < CHOICE_COUNT, choices, -1)
+    codes[:, key < 0] = -1
+    return codes, key, user_ids
+
+
+def sheet_matrices(codes, key):
+    """Indicator matrices for the comparison products: questions answered,
+    one column per (question, choice) chosen, and the same for wrong choices"""
+    n, width = codes.shape
+    answered = (codes >= 0).astype(np.float32)
+    chosen = np.zeros((n, width * CHOICE_COUNT), dtype=np.float32)
+    rows, cols = np.nonzero(codes >= 0)
+    chosen[rows, cols * CHOICE_COUNT + codes[rows, cols]] = 1
+    wrong = chosen.copy()
+    rows, cols = np.nonzero((codes >= 0) & (codes == key))
+    wrong[rows, cols * CHOICE_COUNT + codes[rows, cols]] = 0
+    return answered, chosen, wrong
+
+
+def compare_block(matrices, start, stop, min_common_wrong, keep=MAX_PAIRS):
+    """Compare candidates start..stop-1 with every later candidate.
+
+    Each count is one matrix product of the block's indicator rows with
+    the later rows. Returns how many pairs reached min_common_wrong, how
+    many of those were flagged, and the top `keep` of them as (row, col,
+    shared, identical, common_wrong) arrays.
+    """
+    answered, chosen, wrong = matrices
+    common_wrong = wrong[start:stop] @ wrong[start:].T
+    # Keep the strict upper triangle so each pair is counted once
+    rows, cols = np.nonzero(np.triu(common_wrong >= min_common_wrong, k=1))
+    shared = (answered[start:stop] @ answered[start:].T)[rows, cols].astype(np.int64)
+    identical = (chosen[start:stop] @ chosen[start:].T)[rows, cols].astype(np.int64)
+    common_wrong = common_wrong[rows, cols].astype(np.int64)
+    ratio = common_wrong / np.maximum(shared - identical, 1)
+    top = np.lexsort((-common_wrong, -ratio))[:keep]
+    return (len(rows), int(np.count_nonzero(ratio >= FLAG_RATIO)),
+            (start + rows[top], start + cols[top], shared[top], identical[top], common_wrong[top]))
+
+
+def _init_worker(codes, key):
+    global _worker_state
+    _worker_state = sheet_matrices(codes, key)
+
+
+def _compare_in_worker(start, stop, min_common_wrong):
+    return compare_block(_worker_state, start, stop, min_common_wrong)
+
+
+def similar_pairs(codes, key, min_common_wrong=MIN_COMMON_WRONG, workers=None):
+    """Compare every pair of candidates; returns the number of pairs with
+    at least min_common_wrong identical wrong answers, how many of them
+    are flagged, and the top MAX_PAIRS by ratio as (row, col, shared,
+    identical, common_wrong) arrays"""
+    n = len(codes)
+    blocks = [(start, min(start + BLOCK_SIZE, n)) for start in range(0, n, BLOCK_SIZE)]
+    if workers == 1 or n < PARALLEL_MIN:
+        matrices = sheet_matrices(codes, key)
+        parts = [compare_block(matrices, start, stop, min_common_wrong) for start, stop in blocks]
+    else:
+        workers = workers or os.cpu_count() or 1
+        # Spawn, not fork: the admin server's other threads may hold locks a forked child would inherit.
+        # Workers re-import __main__; admin_app only starts its threads from start_background()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(codes, key)) as pool:
+            parts = list(pool.map(_compare_in_worker, *zip(*blocks), [min_common_wrong] * len(blocks)))
+    if not parts:
+        empty = np.empty(0, dtype=np.int64)
+        return 0, 0, (empty, empty, empty, empty, empty)
+    matched = sum(part[0] for part in parts)
+    flagged = sum(part[1] for part in parts)
+    return matched, flagged, tuple(np.concatenate(column) for column in zip(*(part[2] for part in parts)))
+
+
+def _lookup(conn, user_ids):
+    """Usernames and the set of IP addresses each user submitted or logged in from"""
+    usernames, ips = {}, {}
+    for i in range(0, len(user_ids), LOOKUP_CHUNK):
+        chunk = user_ids[i:i + LOOKUP_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        usernames.update(conn.execute(f'SELECT id, username FROM users WHERE id IN ({placeholders})', chunk))
+        for r in conn.execute(f'''SELECT user_id, ip_address FROM results WHERE user_id IN ({placeholders})
+                                  UNION
+                                  SELECT user_id, ip_address FROM user_sessions WHERE user_id IN ({placeholders})''',
+                              chunk + chunk):
+            if r[1]:
+                ips.setdefault(r[0], set()).add(r[1])
+    return usernames, ips
+
+
+class CollusionReport:
+    """Candidate pairs whose answer sheets agree suspiciously, ranked.
+
+    Pairs are scored on the questions both candidates answered by the
+    ratio of identical wrong answers to answers that differ: honest
+    candidates rarely pick the same wrong option more often than they
+    disagree. Shared IP addresses (from results and login sessions) are
+    listed alongside as corroborating evidence. Answers come from the
+    item analysis columns; the comparison is recomputed only after they
+    or the answer key change.
+    """
+
+    def __init__(self, analysis, connect, workers=None):
+        self.analysis = analysis
+        self.connect = connect
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._cached = None
+        self._cache_key = None
+
+    def _pairs(self, min_common_wrong):
+        generation, columns, bank = self.analysis.snapshot()
+        cache_key = (generation, bank.version, min_common_wrong)
+        if self._cached is not None and bank.version is not None and cache_key == self._cache_key:
+            return self._cached
+        codes, key, user_ids = answer_matrix(*columns, bank.answer_key)
+        matched, flagged, (rows, cols, shared, identical, common_wrong) = \
+            similar_pairs(codes, key, min_common_wrong, self.workers)
+        differences = shared - identical
+        ratio = common_wrong / np.maximum(differences, 1)
+        order = np.lexsort((-common_wrong, -ratio))[:MAX_PAIRS]
+        self._cached = (len(user_ids), matched, flagged, user_ids[rows[order]], user_ids[cols[order]],
+                        shared[order], identical[order], common_wrong[order], differences[order], ratio[order])
+        self._cache_key = cache_key
+        return self._cached
+
+    def report(self, min_common_wrong=MIN_COMMON_WRONG, limit=100):
+        if not AVAILABLE:
+            raise RuntimeError('Collusion detection needs numpy')
+        with self._lock:
+            candidates, matched, flagged, first, second, shared, identical, common_wrong, differences, ratio = \
+                self._pairs(min_common_wrong)
+
+        first, second = first[:limit].tolist(), second[:limit].tolist()
+        involved = sorted(set(first) | set(second))
+        usernames, ips = {}, {}
+        if involved:
+            with self.connect() as conn:
+                usernames, ips = _lookup(conn, involved)
+
+        pairs = []
+        for i, (a, b) in enumerate(zip(first, second)):
+            pairs.append({
+                'user_a': usernames.get(a),
+                'user_b': usernames.get(b),
+                'shared_questions': int(shared[i]),
+                'identical': int(identical[i]),
+                'identical_wrong': int(common_wrong[i]),
+                'differences': int(differences[i]),
+                'ratio': round(float(ratio[i]), 2),
+                'agreement': round(float(identical[i]) / float(shared[i]), 4) if shared[i] else None,
+                'shared_ips': sorted(ips.get(a, set()) & ips.get(b, set())),
+            })
+        return {
+            'candidates': candidates,
+            'pairs_compared': candidates * (candidates - 1) // 2,
+            'matched': matched,
+            'flagged': flagged,
+            'pairs': pairs,
+        }
@@ -15,10 +15,14 @@ class Config:
     SESSION_LIFETIME = int(os.getenv('SESSION_LIFETIME', 3600))
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
+    # Seconds between sweeps that expire student sessions and close their log rows
+    SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 30))
     
     # Rate Limiting
     MAX_LOGIN_ATTEMPTS = int(os.getenv('MAX_LOGIN_ATTEMPTS', 5))
     RATE_LIMIT_WINDOW = int(os.getenv('RATE_LIMIT_WINDOW', 60))
+    # Per client IP; higher than per-user so a shared address is not locked out by typos
+    MAX_LOGIN_ATTEMPTS_PER_IP = int(os.getenv('MAX_LOGIN_ATTEMPTS_PER_IP', 20))
     
     # Performance
     SQLITE_PRAGMAS = {
@@ -26,3 +30,47 @@ class Config:
         'synchronous': 'NORMAL',
         'cache_size': 10000
     }
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', 30))
+    PAYLOAD_CACHE_SIZE = int(os.getenv('PAYLOAD_CACHE_SIZE', 1024))
+    TAB_SWITCH_FLUSH_INTERVAL = float(os.getenv('TAB_SWITCH_FLUSH_INTERVAL', 5))
+    ANSWER_DRAFT_FLUSH_INTERVAL = float(os.getenv('ANSWER_DRAFT_FLUSH_INTERVAL', 2))
+    
+    # Admin live feed (each open stream holds one admin server thread)
+    EVENT_POLL_INTERVAL = float(os.getenv('EVENT_POLL_INTERVAL', 1))
+    MAX_EVENT_STREAMS = int(os.getenv('MAX_EVENT_STREAMS', 4))
+    # Seconds between deletions of change_log rows every reader has applied
+    CHANGE_LOG_PRUNE_INTERVAL = float(os.getenv('CHANGE_LOG_PRUNE_INTERVAL', 60))
+    
+    # Passwords: new hashes use PASSWORD_HASH (scrypt, pbkdf2_sha256 or sha256);
+    # older hashes still verify and are upgraded at the next login
+    PASSWORD_HASH = os.getenv('PASSWORD_HASH', 'scrypt')
+    # Threads verifying login passwords (0 = one per CPU)
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 0))
+    # Processes used to hash passwords in bulk student imports (0 = one per CPU)
+    IMPORT_HASH_WORKERS = int(os.getenv('IMPORT_HASH_WORKERS', 0))
+    # Processes comparing answer sheets for the collusion report (0 = one per CPU)
+    COLLUSION_WORKERS = int(os.getenv('COLLUSION_WORKERS', 0))
+    CREDENTIAL_CACHE_SIZE = int(os.getenv('CREDENTIAL_CACHE_SIZE', 2048))
+    SESSION_LOG_FLUSH_INTERVAL = float(os.getenv('SESSION_LOG_FLUSH_INTERVAL', 1))
+    
+    # Metrics (/metrics on both apps, Prometheus text format). Without a
+    # token only scrapes from the server itself are answered
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    # Where worker processes share their metrics snapshots (serve.py only)
+    METRICS_DIR = os.getenv('METRICS_DIR', 'metrics')
+    METRICS_SNAPSHOT_INTERVAL = float(os.getenv('METRICS_SNAPSHOT_INTERVAL', 5))
+    
+    # Multi-process serving (serve.py sets both); with WORKERS > 1 the login
+    # limits, submission queue, tab-switch counts and answer drafts
+    # coordinate through SQLite
+    WORKERS = int(os.getenv('WORKERS', 1))
+    WORKER_ID = int(os.getenv('WORKER_ID', 0))
+    
+    # Submission queue (write-behind mode for the end-of-exam burst)
+    SUBMISSION_QUEUE_ENABLED = os.getenv('SUBMISSION_QUEUE_ENABLED', 'false').lower() == 'true'
+    SUBMISSION_JOURNAL_PATH = os.getenv('SUBMISSION_JOURNAL_PATH', 'submissions.journal')
+    SUBMISSION_BATCH_SIZE = int(os.getenv('SUBMISSION_BATCH_SIZE', 50))
+    SUBMISSION_FLUSH_INTERVAL = float(os.getenv('SUBMISSION_FLUSH_INTERVAL', 0.2))
@@ -0,0 +1,93 @@
+import os
+import hmac
+import hashlib
+import threading
+from collections import OrderedDict
+from question_cache import read_version, USERS
+
+
+class Credential:
+    __slots__ = ('user_id', 'username', 'password', 'attempted', 'verified')
+
+    def __init__(self, user_id, username, password, attempted):
+        self.user_id = user_id
+        self.username = username
+        self.password = password
+        self.attempted = attempted
+        # Keyed digest of the last password that verified against this hash
+        self.verified = None
+
+
+class CredentialCache:
+    """Bounded LRU of student credentials keyed by username.
+
+    Each lookup costs one primary-key read of cache_versions (plus one of
+    users while the student has not submitted); the admin student endpoints
+    bump the users version, which empties the cache.
+    A successful slow-hash verification is remembered as an HMAC under a
+    per-process random key, so a student logging in again (browser crash,
+    second device) skips scrypt.
+    """
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self._key = os.urandom(32)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _digest(self, password):
+        return hmac.new(self._key, password.encode(), hashlib.sha256).digest()
+
+    def lookup(self, conn, username):
+        version = read_version(conn, USERS)
+        with self._lock:
+            if version is None or version != self._version:
+                if self._entries:
+                    self.stats['invalidations'] += 1
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(username)
+            if entry is not None:
+                self._entries.move_to_end(username)
+                self.stats['hits'] += 1
+
+        if entry is not None:
+            if not entry.attempted:
+                # Submissions do not bump the users version, and may have
+                # been handled by another worker process
+                row = conn.execute('SELECT attempted FROM users WHERE id = ?', (entry.user_id,)).fetchone()
+                if row is None:
+                    return None
+                entry.attempted = row['attempted']
+            return entry
+
+        row = conn.execute('SELECT id, username, password, attempted FROM users WHERE username = ? AND role = "student"',
+                           (username,)).fetchone()
+        with self._lock:
+            self.stats['misses'] += 1
+            if row is None:
+                return None
+            entry = Credential(row['id'], row['username'], row['password'], row['attempted'])
+            if version is not None and version == self._version:
+                self._entries[username] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+        return entry
+
+    def is_verified(self, entry, password):
+        return entry.verified is not None and hmac.compare_digest(entry.verified, self._digest(password))
+
+    def remember(self, entry, password):
+        entry.verified = self._digest(password)
+
+    def mark_attempted(self, username):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None:
+                entry.attempted = 1
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,191 @@
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from config import Config
+from metrics import InstrumentedConnection, DB_CONNECTION_HOLD
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the wait timeout"""
+
+
+class ConnectionPool:
+    """Bounded checkout/return pool of SQLite connections.
+
+    Pragmas are applied once when a connection is opened, so the page cache
+    survives between requests. Connections are handed from thread to thread
+    by waitress, hence check_same_thread=False; a connection is only ever
+    used by the thread that checked it out.
+    """
+
+    def __init__(self, db_path, size=10, timeout=10.0, pragmas=None, health_check_interval=30.0):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas or {}
+        self.health_check_interval = health_check_interval
+
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._open = 0
+        self._closed = False
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               factory=InstrumentedConnection if Config.METRICS_ENABLED else sqlite3.Connection)
+        conn.row_factory = sqlite3.Row
+        for pragma, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {pragma}={value}')
+        self._stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn):
+        self._stats['health_checks'] += 1
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error as e:
+            self._stats['health_check_failures'] += 1
+            logger.warning(f"Discarding unhealthy pooled connection: {e}")
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._open -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    def acquire(self):
+        """Check out a connection, waiting up to self.timeout seconds"""
+        started = time.monotonic()
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout('Connection pool is closed')
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    conn, last_used = None, None
+                    break
+
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                waited = True
+                self._cond.wait(remaining)
+
+            self._stats['checkouts'] += 1
+            if waited:
+                elapsed = time.monotonic() - started
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += elapsed
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], elapsed)
+
+        if conn is None:
+            try:
+                return self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+
+        if time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(conn):
+            self._discard(conn)
+            return self.acquire()
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        if discard or self._closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        checked_out = time.perf_counter()
+        try:
+            yield conn
+        except (sqlite3.InterfaceError, sqlite3.ProgrammingError):
+            broken = True
+            raise
+        finally:
+            self.release(conn, discard=broken)
+            DB_CONNECTION_HOLD.observe(time.perf_counter() - checked_out)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open - len(self._idle)
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
+
+    def close_all(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool for Config.DB_PATH, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    Config.DB_PATH,
+                    size=Config.DB_POOL_SIZE,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                    pragmas=Config.SQLITE_PRAGMAS,
+                    health_check_interval=Config.DB_POOL_HEALTH_CHECK_INTERVAL,
+                )
+    return _pool
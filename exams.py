@@ -0,0 +1,24 @@
+def create_exam(conn, user_id, question_ids):
+    """Record a user's exam paper, preserving question order; returns the exam id"""
+    exam_id = conn.execute('INSERT INTO active_exams (user_id) VALUES (?)', (user_id,)).lastrowid
+    conn.executemany('INSERT INTO exam_questions (exam_id, position, question_id) VALUES (?, ?, ?)',
+                     ((exam_id, position, qid) for position, qid in enumerate(question_ids)))
+    return exam_id
+
+
+def load_exam(conn, user_id):
+    """Return the ordered question ids of a user's active exam, or None"""
+    rows = conn.execute('''SELECT a.id, eq.question_id
+                           FROM active_exams a
+                           LEFT JOIN exam_questions eq ON eq.exam_id = a.id
+                           WHERE a.user_id = ?
+                           ORDER BY eq.position''', (user_id,)).fetchall()
+    if not rows:
+        return None
+    return [r['question_id'] for r in rows if r['question_id'] is not None]
+
+
+def delete_exam(conn, user_id):
+    conn.execute('DELETE FROM exam_questions WHERE exam_id IN (SELECT id FROM active_exams WHERE user_id = ?)',
+                 (user_id,))
+    conn.execute('DELETE FROM active_exams WHERE user_id = ?', (user_id,))
@@ -0,0 +1,30 @@
+from collections import namedtuple
+
+# Subtract 1 mark for each tab switch after this many
+FREE_TAB_SWITCHES = 2
+
+Grade = namedtuple('Grade', ['score', 'penalty', 'final_score', 'total', 'answer_rows'])
+
+
+def tab_switch_penalty(max_switches):
+    return max(0, (max_switches or 0) - FREE_TAB_SWITCHES)
+
+
+def grade_answers(user_id, question_ids, answers, answer_key, max_switches=0):
+    """Score a submission in memory.
+
+    question_ids is the exam's ordered list of ints, answers maps the
+    question id (as sent by the browser, a string) to the chosen letter and
+    answer_key maps question id to the correct letter. Returns the score
+    together with the answer rows to store (see answer_sheets.save_answers).
+    """
+    score = 0
+    answer_rows = []
+    for qid in question_ids:
+        selected = answers.get(str(qid), '')
+        answer_rows.append((user_id, qid, selected))
+        if selected and selected == answer_key.get(qid):
+            score += 1
+
+    penalty = tab_switch_penalty(max_switches)
+    return Grade(score, penalty, max(0, score - penalty), len(question_ids), answer_rows)
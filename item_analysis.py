@@ -0,0 +1,259 @@
+import math
+import threading
+from change_log import latest_change_id, RESULT
+from answer_sheets import read_sheets
+from question_cache import exam_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+AVAILABLE = np is not None
+
+CHOICES = ('A', 'B', 'C', 'D')
+# Choice codes: 0-3 for A-D, BLANK for anything else (unanswered)
+CODES = {letter: code for code, letter in enumerate(CHOICES)}
+BLANK = len(CHOICES)
+
+# Share of candidates in each of the upper and lower groups for the discrimination index
+GROUP_FRACTION = 0.27
+
+
+def _number(value, digits=4):
+    value = float(value)
+    return None if math.isnan(value) or math.isinf(value) else round(value, digits)
+
+
+def _ratio(num, den):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, num / np.maximum(den, 1), np.nan)
+
+
+class AnswerColumns:
+    """Submitted answers as three parallel arrays: user id, question id, choice code"""
+
+    def __init__(self):
+        self.users = np.empty(0, dtype=np.int64)
+        self.questions = np.empty(0, dtype=np.int64)
+        self.choices = np.empty(0, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.users)
+
+    @staticmethod
+    def from_sheets(sheets):
+        """Columns from (user_id, question_ids, choices, answered) packed answer sheets.
+
+        The blobs of all sheets are joined and decoded together: each
+        answer's position within its own sheet picks its 2-bit choice and
+        its answered bit out of the joined byte arrays.
+        """
+        sheets = list(sheets)
+        if not sheets:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8)
+        user_ids, id_blobs, choice_blobs, answered_blobs = zip(*sheets)
+        counts = np.array([len(blob) // 4 for blob in id_blobs], dtype=np.int64)
+        users = np.repeat(np.array(user_ids, dtype=np.int64), counts)
+        questions = np.frombuffer(b''.join(id_blobs), dtype='<i4').astype(np.int64)
+
+        position = np.arange(len(questions)) - np.repeat(np.cumsum(counts) - counts, counts)
+        choice_lengths = np.array([len(blob) for blob in choice_blobs], dtype=np.int64)
+        answered_lengths = np.array([len(blob) for blob in answered_blobs], dtype=np.int64)
+        choice_bytes = np.frombuffer(b''.join(choice_blobs), dtype=np.uint8)
+        answered_bytes = np.frombuffer(b''.join(answered_blobs), dtype=np.uint8)
+        choice = choice_bytes[np.repeat(np.cumsum(choice_lengths) - choice_lengths, counts) + position // 4]
+        choice = (choice >> (2 * (position % 4)).astype(np.uint8)) & 3
+        answered = answered_bytes[np.repeat(np.cumsum(answered_lengths) - answered_lengths, counts) + position // 8]
+        answered = (answered >> (position % 8).astype(np.uint8)) & 1
+        return users, questions, np.where(answered == 1, choice, BLANK).astype(np.int8)
+
+    def append(self, users, questions, choices):
+        self.users = np.concatenate((self.users, users))
+        self.questions = np.concatenate((self.questions, questions))
+        self.choices = np.concatenate((self.choices, choices))
+
+    def drop_users(self, user_ids):
+        keep = ~np.isin(self.users, np.fromiter(user_ids, dtype=np.int64))
+        self.users = self.users[keep]
+        self.questions = self.questions[keep]
+        self.choices = self.choices[keep]
+
+
+def analyse(columns, answer_key, question_text=None):
+    """Item statistics for every question that was answered at least once.
+
+    Candidates may each see a different random subset of the bank, so every
+    per-question figure is over the candidates who were shown it:
+    difficulty is the proportion correct, discrimination the difference in
+    proportion correct between the top and bottom 27% of candidates by
+    overall proportion correct, and point_biserial the correlation with
+    the rest of the candidate's paper. KR-20 weights each item's variance
+    by the share of candidates who saw it, which reduces to the usual
+    formula when everyone sat the same questions.
+    """
+    question_text = question_text or {}
+    if not len(columns):
+        return {'candidates': 0, 'responses': 0, 'kr20': None, 'mean_score': None, 'questions': []}
+
+    user_ids, u = np.unique(columns.users, return_inverse=True)
+    question_ids, q = np.unique(columns.questions, return_inverse=True)
+    n_users, n_questions = len(user_ids), len(question_ids)
+
+    key = np.array([CODES.get(answer_key.get(int(qid)), -1) for qid in question_ids], dtype=np.int8)
+    correct = (columns.choices == key[q]).astype(np.float64)
+
+    # Per candidate: questions shown, number right, proportion right
+    shown = np.bincount(u, minlength=n_users).astype(np.float64)
+    right = np.bincount(u, weights=correct, minlength=n_users)
+    proportion = right / shown
+
+    # Per question: responses, difficulty and choice distribution
+    presented = np.bincount(q, minlength=n_questions).astype(np.float64)
+    difficulty = np.bincount(q, weights=correct, minlength=n_questions) / presented
+    distribution = np.bincount(q * (BLANK + 1) + columns.choices, minlength=n_questions * (BLANK + 1))
+    distribution = distribution.reshape(n_questions, BLANK + 1)
+
+    # Upper and lower groups by overall proportion correct
+    group_size = max(1, int(round(GROUP_FRACTION * n_users)))
+    order = np.argsort(proportion, kind='stable')
+    group = np.zeros(n_users, dtype=np.int8)
+    group[order[:group_size]] = -1
+    group[order[-group_size:]] = 1
+    row_group = group[u]
+    upper, lower = row_group == 1, row_group == -1
+    p_upper = _ratio(np.bincount(q[upper], weights=correct[upper], minlength=n_questions),
+                     np.bincount(q[upper], minlength=n_questions))
+    p_lower = _ratio(np.bincount(q[lower], weights=correct[lower], minlength=n_questions),
+                     np.bincount(q[lower], minlength=n_questions))
+    discrimination = p_upper - p_lower
+
+    # Point-biserial against the rest of the paper (the item itself excluded)
+    rest = _ratio(right[u] - correct, shown[u] - 1)
+    valid = ~np.isnan(rest)
+    n = np.bincount(q[valid], minlength=n_questions).astype(np.float64)
+    x, y = correct[valid], rest[valid]
+    qv = q[valid]
+    mean_x = _ratio(np.bincount(qv, weights=x, minlength=n_questions), n)
+    mean_y = _ratio(np.bincount(qv, weights=y, minlength=n_questions), n)
+    cov = _ratio(np.bincount(qv, weights=x * y, minlength=n_questions), n) - mean_x * mean_y
+    var_y = _ratio(np.bincount(qv, weights=y * y, minlength=n_questions), n) - mean_y ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        point_biserial = cov / np.sqrt(mean_x * (1 - mean_x) * var_y)
+
+    k = shown.mean()
+    score_variance = right.var()
+    item_variance = np.sum(presented / n_users * difficulty * (1 - difficulty))
+    kr20 = k / (k - 1) * (1 - item_variance / score_variance) if k > 1 and score_variance > 0 else float('nan')
+
+    questions = []
+    for i, qid in enumerate(question_ids.tolist()):
+        counts = distribution[i].tolist()
+        questions.append({
+            'question_id': qid,
+            'question': question_text.get(qid),
+            'correct_answer': answer_key.get(qid),
+            'presented': int(presented[i]),
+            'difficulty': _number(difficulty[i]),
+            'discrimination': _number(discrimination[i]),
+            'point_biserial': _number(point_biserial[i]),
+            'choices': dict(zip(CHOICES + ('blank',), counts)),
+        })
+    return {
+        'candidates': n_users,
+        'responses': len(columns),
+        'kr20': _number(kr20),
+        'mean_score': _number(right.mean(), 2),
+        'questions': questions,
+    }
+
+
+class ItemAnalysis:
+    """Item statistics over the submitted answer sheets, kept current incrementally.
+
+    The first report loads every submitted answer in one pass; later
+    reports append only the answers of submissions logged to change_log
+    since, and the statistics are recomputed vectorized over the columns.
+    A report is reused until new submissions arrive or the question bank
+    version changes (an edited answer key changes which answers are right).
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+
+        self._lock = threading.Lock()
+        self._columns = None
+        self._users = set()
+        self._last_id = None
+        self._report = None
+        self._bank_version = None
+        # Bumped whenever the columns change, so derived reports know when to recompute
+        self._generation = 0
+
+    def _load(self, conn):
+        # Log position first: submissions committed after it are replayed by _sync
+        last_id = latest_change_id(conn)
+        self._columns = AnswerColumns()
+        self._columns.append(*AnswerColumns.from_sheets(read_sheets(conn)))
+        self._users = set(np.unique(self._columns.users).tolist())
+        self._last_id = last_id
+        self._report = None
+        self._generation += 1
+
+    def _sync(self, conn):
+        last_id = latest_change_id(conn)
+        if last_id == self._last_id:
+            return
+        user_ids = [r[0] for r in conn.execute('''SELECT DISTINCT user_id FROM change_log
+                                                 WHERE id > ? AND id <= ? AND kind = ?''',
+                                               (self._last_id, last_id, RESULT))]
+        if user_ids:
+            replayed = self._users.intersection(user_ids)
+            if replayed:
+                self._columns.drop_users(replayed)
+            self._columns.append(*AnswerColumns.from_sheets(read_sheets(conn, user_ids)))
+            self._users.update(user_ids)
+            self._report = None
+            self._generation += 1
+        self._last_id = last_id
+
+    def _refresh(self):
+        with self.connect() as conn:
+            if self._last_id is None:
+                self._load(conn)
+            else:
+                self._sync(conn)
+            return exam_cache.get_bank(conn)
+
+    def report(self):
+        if not AVAILABLE:
+            raise RuntimeError('Item analysis needs numpy')
+        with self._lock:
+            bank = self._refresh()
+            if self._report is None or bank.version != self._bank_version or bank.version is None:
+                text = {qid: q.question for qid, q in bank.by_id.items()}
+                self._report = analyse(self._columns, bank.answer_key, text)
+                self._bank_version = bank.version
+            return self._report
+
+    def snapshot(self):
+        """(generation, (users, questions, choices), bank) for analyses built on the same answers"""
+        if not AVAILABLE:
+            raise RuntimeError('Item analysis needs numpy')
+        with self._lock:
+            bank = self._refresh()
+            columns = self._columns
+            return self._generation, (columns.users, columns.questions, columns.choices), bank
+
+    def last_change_id(self):
+        """change_log position applied so far, or None before the first load"""
+        return self._last_id
+
+    def remove(self, user_id):
+        """Forget a deleted student's answers"""
+        with self._lock:
+            if self._columns is not None and user_id in self._users:
+                self._columns.drop_users([user_id])
+                self._users.discard(user_id)
+                self._report = None
+                self._generation += 1
@@ -0,0 +1,170 @@
+import json
+import base64
+import bisect
+import threading
+from collections import namedtuple
+from change_log import latest_change_id, RESULT
+
+Entry = namedtuple('Entry', ['user_id', 'username', 'ip_address', 'score', 'total_questions', 'submitted_at'])
+
+
+def rank_key(entry):
+    # Same order as idx_results_rank: score DESC, submitted_at, user_id
+    return (-entry.score, entry.submitted_at, entry.user_id)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Opaque page cursor back to a rank key; raises ValueError if malformed"""
+    try:
+        score, submitted_at, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    # Anything else would fail inside bisect when compared with real keys
+    if (not isinstance(score, (int, float)) or isinstance(score, bool) or not isinstance(submitted_at, str)
+            or not isinstance(user_id, int) or isinstance(user_id, bool)):
+        raise ValueError('Invalid cursor')
+    return (score, submitted_at, user_id)
+
+
+class Leaderboard:
+    """Ranked results kept in memory and updated once per submission.
+
+    The first query loads results in index order; after that each query
+    applies only the result rows appended to change_log since the last one,
+    so the ranking is never re-sorted. Entries are keyed by user: a student
+    whose attempt was reset and who submitted again is ranked by their
+    latest result, on the first load and on every update alike. Ranks are
+    1-based positions in the sorted key list, and pages are addressed by
+    the rank key of the last row seen.
+
+    Keys live in a plain sorted list, so placing or moving an entry is a
+    binary search plus an O(n) shift of the list; at a few thousand
+    students that is a memmove of some kilobytes, well under the cost of
+    the query that brought the result in.
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+
+        self._lock = threading.Lock()
+        self._keys = []
+        self._entries = {}
+        self._by_username = {}
+        self._last_id = None
+
+    def _insert(self, entry):
+        self._discard(entry.user_id)
+        key = rank_key(entry)
+        self._keys.insert(bisect.bisect_left(self._keys, key), key)
+        self._entries[entry.user_id] = entry
+        self._by_username[entry.username] = entry.user_id
+
+    def _discard(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        key = rank_key(entry)
+        del self._keys[bisect.bisect_left(self._keys, key)]
+        self._by_username.pop(entry.username, None)
+
+    def _load(self, conn):
+        # Read the log position first: anything committed after it is
+        # replayed by _sync, and replaying a result is idempotent
+        last_id = latest_change_id(conn)
+        # Only each user's latest result, as _sync replaces an entry with the newest one
+        rows = conn.execute('''SELECT r.user_id, u.username, r.ip_address, r.score, r.total_questions, r.submitted_at
+                               FROM results r
+                               JOIN users u ON r.user_id = u.id
+                               WHERE r.id = (SELECT MAX(l.id) FROM results l WHERE l.user_id = r.user_id)
+                               ORDER BY r.score DESC, r.submitted_at ASC, r.user_id ASC''').fetchall()
+        self._keys = []
+        self._entries = {}
+        self._by_username = {}
+        for r in rows:
+            entry = Entry(*r)
+            self._entries[entry.user_id] = entry
+            self._by_username[entry.username] = entry.user_id
+            self._keys.append(rank_key(entry))
+        self._last_id = last_id
+
+    def _sync(self, conn):
+        last_id = latest_change_id(conn)
+        rows = conn.execute('''SELECT c.user_id, c.payload, u.username
+                               FROM change_log c
+                               JOIN users u ON u.id = c.user_id
+                               WHERE c.id > ? AND c.id <= ? AND c.kind = ?
+                               ORDER BY c.id''', (self._last_id, last_id, RESULT)).fetchall()
+        for r in rows:
+            data = json.loads(r['payload'])
+            self._insert(Entry(r['user_id'], r['username'], data['ip_address'], data['score'],
+                               data['total_questions'], data['submitted_at']))
+        self._last_id = last_id
+
+    def refresh(self):
+        with self._lock:
+            with self.connect() as conn:
+                if self._last_id is None:
+                    self._load(conn)
+                else:
+                    self._sync(conn)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._discard(user_id)
+
+    def last_change_id(self):
+        """change_log position applied so far, or None before the first load"""
+        return self._last_id
+
+    def __len__(self):
+        return len(self._keys)
+
+    def rank(self, username):
+        """(rank, entry) for a student, or None if they have no result"""
+        self.refresh()
+        with self._lock:
+            user_id = self._by_username.get(username)
+            if user_id is None:
+                return None
+            entry = self._entries[user_id]
+            return bisect.bisect_left(self._keys, rank_key(entry)) + 1, entry
+
+    def page(self, after=None, limit=50, min_score=None, max_score=None,
+             since=None, until=None, username_prefix=None):
+        """One page of ranked rows plus the cursor for the next page (or None).
+
+        Score bands seek straight to their first key; time window and
+        username filters are applied while scanning forward from there.
+        """
+        self.refresh()
+        with self._lock:
+            start = 0
+            if max_score is not None:
+                start = bisect.bisect_left(self._keys, (-max_score,))
+            if after is not None:
+                start = max(start, bisect.bisect_right(self._keys, after))
+
+            rows = []
+            next_cursor = None
+            for idx in range(start, len(self._keys)):
+                key = self._keys[idx]
+                if min_score is not None and -key[0] < min_score:
+                    break
+                entry = self._entries[key[2]]
+                if since and entry.submitted_at < since:
+                    continue
+                if until and entry.submitted_at > until:
+                    continue
+                if username_prefix and not entry.username.startswith(username_prefix):
+                    continue
+                if len(rows) == limit:
+                    next_cursor = encode_cursor(rank_key(self._entries[rows[-1]['user_id']]))
+                    break
+                row = entry._asdict()
+                row['rank'] = idx + 1
+                rows.append(row)
+            return rows, next_cursor
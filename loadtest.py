@@ -0,0 +1,328 @@
+"""Load test: drive both apps under waitress through a scripted exam session.
+
+    python loadtest.py --students 150 --questions 200 --per-exam 50
+
+Seeds a fresh database (nothing touches exam.db unless --db points at it),
+serves app.py and admin_app.py with waitress on local ports, and replays an
+exam: login storm, exam start plus a refresh-resume, answer autosaves and
+periodic tab-switch events, a synchronized auto-submit, and admin dashboard
+polling throughout.
+Prints p50/p95/p99 latency, throughput, errors and SQLITE_BUSY counts per
+endpoint, plus the deepest waitress task queue seen. Both apps share one
+process (and one connection pool) here, so treat the numbers as a
+regression baseline rather than exam-day capacity. --max-p95 and
+--max-errors turn it into a pass/fail regression gate.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import urllib.request
+import urllib.error
+import http.cookiejar
+from collections import defaultdict
+
+
+class LogCounter(logging.Handler):
+    """Counts SQLITE_BUSY ("database is locked") errors and tracks waitress queue depth"""
+
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.busy = 0
+        self.max_queue_depth = 0
+
+    def emit(self, record):
+        message = record.getMessage()
+        if 'database is locked' in message or 'database is busy' in message:
+            self.busy += 1
+        elif message.startswith('Task queue depth is '):
+            self.max_queue_depth = max(self.max_queue_depth, int(message.rsplit(' ', 1)[1]))
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.started = time.monotonic()
+
+    def add(self, endpoint, elapsed, ok):
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+class Client:
+    """One browser: its own cookie jar, timings recorded per endpoint"""
+
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, endpoint, path, method='GET', data=None, headers=None, expect=(200,)):
+        body = json.dumps(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        if body is not None:
+            req.add_header('Content-Type', 'application/json')
+
+        started = time.monotonic()
+        status, payload, response_headers = None, None, {}
+        try:
+            with self.opener.open(req, timeout=60) as res:
+                status, payload, response_headers = res.status, res.read(), res.headers
+        except urllib.error.HTTPError as e:
+            status, payload, response_headers = e.code, e.read(), e.headers
+        except Exception:
+            pass
+        self.recorder.add(endpoint, time.monotonic() - started, status in expect)
+
+        if payload and response_headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                return status, json.loads(payload), response_headers
+            except ValueError:
+                pass
+        return status, None, response_headers
+
+
+def seed_database(db_path, students, questions, per_exam, duration=30):
+    os.environ['DB_PATH'] = db_path
+    import sqlite3
+    from init_db import init_db
+    from add_sample_data import SAMPLE_QUESTIONS, hash_password
+    from question_bank import import_questions, FIELDS
+
+    init_db()
+    conn = sqlite3.connect(db_path)
+    records = ((i, dict(zip(FIELDS, (f'[{i}] {q[0]}',) + q[1:])))
+               for i, q in ((i, SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]) for i in range(questions)))
+    import_questions(conn, records)
+    password = hash_password('pass123')
+    conn.executemany('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
+                     ((f'load{i:05d}', password, 'student') for i in range(students)))
+    conn.execute('UPDATE exam_settings SET duration_minutes = ?, questions_per_exam = ? WHERE id = 1',
+                 (duration, per_exam))
+    conn.commit()
+    conn.close()
+
+
+def serve(app, threads):
+    """Run a waitress server on a free local port for the rest of the process"""
+    from waitress import create_server
+    server = create_server(app, host='127.0.0.1', port=0, threads=threads, connection_limit=1000)
+    threading.Thread(target=server.run, daemon=True).start()
+    return f'http://127.0.0.1:{server.effective_port}'
+
+
+def student_session(index, args, student_url, recorder, barriers, submit_at):
+    client = Client(student_url, recorder)
+    rng = random.Random(index)
+    headers = {'X-Client-IP': f'10.0.{index // 250}.{index % 250 + 1}'}
+
+    # A student that fails a step still waits at each barrier so the others are not stuck
+    barriers['login'].wait()
+    status, _, _ = client.request('POST /api/login', '/api/login', 'POST',
+                                  {'username': f'load{index:05d}', 'password': 'pass123'}, headers)
+    logged_in = status == 200
+
+    barriers['start'].wait()
+    questions = None
+    if logged_in:
+        status, exam, response_headers = client.request('GET /api/exam/start', '/api/exam/start')
+        if status == 200 and exam:
+            questions = [q['id'] for q in exam['questions']]
+
+            # A refresh mid-exam revalidates the cached paper
+            etag = response_headers.get('ETag')
+            client.request('GET /api/exam/start (resume)', '/api/exam/start',
+                           headers={'If-None-Match': etag} if etag else None, expect=(200, 304))
+            client.request('GET /api/tab-switch-count', '/api/tab-switch-count')
+            client.request('GET /api/exam/autosave', '/api/exam/autosave')
+
+    # Answers change between events and are autosaved as deltas, as exam.html does
+    answers, unsaved = {}, {}
+    seq = switches = 0
+    while questions is not None and time.monotonic() < submit_at:
+        time.sleep(min(rng.expovariate(1 / args.tab_switch_interval), max(0, submit_at - time.monotonic())))
+        if time.monotonic() >= submit_at:
+            break
+        for qid in rng.sample(questions, min(len(questions), 3)):
+            answers[str(qid)] = rng.choice('ABCD')
+            unsaved[str(qid)] = seq + 1
+        seq += 1
+        status, saved, _ = client.request('POST /api/exam/autosave', '/api/exam/autosave', 'POST',
+                                          {'seq': seq, 'answers': {qid: answers[qid] for qid in unsaved}})
+        if status == 200 and saved:
+            unsaved = {qid: first for qid, first in unsaved.items() if first > saved['saved']}
+        if rng.random() < args.tab_switch_probability:
+            switches += 1
+            client.request('POST /api/tab-switch', '/api/tab-switch', 'POST', {'count': switches}, headers)
+
+    # Every timer runs out at the same moment
+    barriers['submit'].wait()
+    if questions is not None:
+        for qid in questions:
+            if str(qid) not in answers:
+                answers[str(qid)] = rng.choice('ABCD')
+                unsaved[str(qid)] = seq + 1
+        client.request('POST /api/exam/submit', '/api/exam/submit', 'POST',
+                       {'seq': seq + 1, 'answers': {qid: answers[qid] for qid in unsaved}}, headers)
+        client.request('POST /api/logout', '/api/logout', 'POST', {})
+
+
+def admin_poller(args, admin_url, recorder, stop):
+    client = Client(admin_url, recorder)
+    client.request('POST /api/admin/login', '/api/admin/login', 'POST',
+                   {'username': 'admin', 'password': 'admin123'})
+    while not stop.is_set():
+        client.request('GET /api/admin/results', '/api/admin/results')
+        client.request('GET /api/admin/sessions', '/api/admin/sessions')
+        client.request('GET /api/admin/tab-switches', '/api/admin/tab-switches')
+        stop.wait(args.admin_interval)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def build_report(recorder, elapsed, counter, pool):
+    endpoints = {}
+    for endpoint, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'errors': recorder.errors.get(endpoint, 0),
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2),
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 2),
+        'errors': sum(e['errors'] for e in endpoints.values()),
+        'sqlite_busy': counter.busy,
+        'max_queue_depth': counter.max_queue_depth,
+        'pool': pool,
+        'endpoints': endpoints,
+    }
+
+
+def print_report(report):
+    print(f"\n{'Endpoint':<34}{'reqs':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for endpoint, e in report['endpoints'].items():
+        print(f"{endpoint:<34}{e['requests']:>7}{e['errors']:>6}{e['throughput_rps']:>9}"
+              f"{e['p50_ms']:>10}{e['p95_ms']:>10}{e['p99_ms']:>10}{e['max_ms']:>10}")
+    print(f"\nTotal: {report['requests']} requests in {report['elapsed_s']}s "
+          f"({report['throughput_rps']} req/s), {report['errors']} errors, "
+          f"{report['sqlite_busy']} SQLITE_BUSY, max waitress queue depth {report['max_queue_depth']}, "
+          f"pool waits {report['pool']['waits']}, pool timeouts {report['pool']['timeouts']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate a full exam session against both apps')
+    parser.add_argument('--students', type=int, default=150)
+    parser.add_argument('--questions', type=int, default=100, help='questions in the bank')
+    parser.add_argument('--per-exam', type=int, default=30, help='questions per exam')
+    parser.add_argument('--exam-seconds', type=float, default=20, help='time between start and auto-submit')
+    parser.add_argument('--tab-switch-interval', type=float, default=5, help='mean seconds between focus changes')
+    parser.add_argument('--tab-switch-probability', type=float, default=0.3)
+    parser.add_argument('--admin-pollers', type=int, default=3, help='proctor dashboards open')
+    parser.add_argument('--admin-interval', type=float, default=10, help='dashboard refresh period')
+    parser.add_argument('--student-threads', type=int, default=8, help='waitress threads for app.py')
+    parser.add_argument('--admin-threads', type=int, default=4, help='waitress threads for admin_app.py')
+    parser.add_argument('--db', help='database path (default: a temporary copy that is deleted afterwards)')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--max-p95', type=float, help='fail if any endpoint p95 exceeds this many ms')
+    parser.add_argument('--max-errors', type=int, help='fail if more requests than this fail')
+    args = parser.parse_args(argv)
+
+    workdir = None
+    db_path = args.db
+    if not db_path:
+        workdir = tempfile.mkdtemp(prefix='exam-loadtest-')
+        db_path = os.path.join(workdir, 'exam.db')
+        os.environ.setdefault('SUBMISSION_JOURNAL_PATH', os.path.join(workdir, 'submissions.journal'))
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    counter = LogCounter()
+    logging.getLogger().addHandler(counter)
+    # Queue depth warnings are summarised in the report instead of printed
+    queue_logger = logging.getLogger('waitress.queue')
+    queue_logger.addHandler(counter)
+    queue_logger.propagate = False
+
+    try:
+        print(f"Seeding {args.students} students and {args.questions} questions into {db_path}")
+        seed_database(db_path, args.students, args.questions, args.per_exam)
+
+        # Config is read at import time, so the apps are imported after DB_PATH is set
+        import app as student_app
+        import admin_app
+        from db_pool import get_pool
+        logging.getLogger().setLevel(logging.WARNING)
+
+        student_url = serve(student_app.app, args.student_threads)
+        admin_url = serve(admin_app.app, args.admin_threads)
+
+        recorder = Recorder()
+        barriers = {name: threading.Barrier(args.students) for name in ('login', 'start', 'submit')}
+        stop = threading.Event()
+        submit_at = time.monotonic() + args.exam_seconds
+
+        pollers = [threading.Thread(target=admin_poller, args=(args, admin_url, recorder, stop), daemon=True)
+                   for _ in range(args.admin_pollers)]
+        students = [threading.Thread(target=student_session,
+                                     args=(i, args, student_url, recorder, barriers, submit_at), daemon=True)
+                    for i in range(args.students)]
+
+        print(f"Running exam: {args.students} students, {args.per_exam} questions each, "
+              f"submit in {args.exam_seconds}s")
+        for t in pollers + students:
+            t.start()
+        for t in students:
+            t.join()
+        stop.set()
+        for t in pollers:
+            t.join(args.admin_interval + 5)
+
+        elapsed = time.monotonic() - recorder.started
+        report = build_report(recorder, elapsed, counter, get_pool().stats())
+        print_report(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = False
+    if args.max_errors is not None and report['errors'] > args.max_errors:
+        print(f"FAIL: {report['errors']} errors (limit {args.max_errors})")
+        failed = True
+    if args.max_p95 is not None:
+        for endpoint, e in report['endpoints'].items():
+            if e['p95_ms'] > args.max_p95:
+                print(f"FAIL: {endpoint} p95 {e['p95_ms']}ms (limit {args.max_p95}ms)")
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,394 @@
+import os
+import json
+import hmac
+import time
+import bisect
+import sqlite3
+import threading
+import logging
+from flask import request as current_request
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+VERBS = frozenset(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH', 'BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA'))
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in items]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is one bisect and one locked update"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', dict(labels, le=str(bound)), cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class Registry:
+    """Metrics owned by this process plus collectors read at scrape time.
+
+    A collector returns a list of (name, type, help, samples) families; it
+    is how components that already keep a stats dict are exposed without
+    touching their hot paths. Named collectors and caches replace earlier
+    ones of the same name, so both apps can share a process (loadtest.py).
+    """
+
+    def __init__(self, prefix='exam_'):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = {}
+        self._caches = {}
+        self.register(self._collect_caches, 'caches')
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(self.prefix + name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, labels, buckets))
+
+    def register(self, collect, name=None):
+        self._collectors[name or id(collect)] = collect
+
+    def stats(self, name, read, help):
+        """Expose a component's stats dict as exam_<name>_<key> values"""
+        def collect():
+            return [(f'{self.prefix}{name}_{key}', 'untyped', help, [(f'{self.prefix}{name}_{key}', {}, value)])
+                    for key, value in read().items() if isinstance(value, (int, float))]
+        self.register(collect, f'stats:{name}')
+
+    def caches(self, caches):
+        """Expose hit and miss counts; caches maps a name to a callable returning (hits, misses)"""
+        self._caches.update(caches)
+
+    def _collect_caches(self):
+        if not self._caches:
+            return []
+        counts = {name: read() for name, read in self._caches.items()}
+        return [
+            (f'{self.prefix}cache_hits_total', 'counter', 'Cache lookups answered from memory',
+             [(f'{self.prefix}cache_hits_total', {'cache': name}, hits) for name, (hits, _) in counts.items()]),
+            (f'{self.prefix}cache_misses_total', 'counter', 'Cache lookups that went to the database',
+             [(f'{self.prefix}cache_misses_total', {'cache': name}, misses) for name, (_, misses) in counts.items()]),
+        ]
+
+    def collect(self):
+        families = [(m.name, m.type, m.help, m.samples()) for m in self._metrics]
+        for collect in list(self._collectors.values()):
+            try:
+                families.extend(collect())
+            except Exception as e:
+                logger.error(f"Metrics collector error: {e}")
+        return families
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter('http_requests_total', 'HTTP requests handled',
+                                 ('app', 'route', 'method', 'status'))
+HTTP_DURATION = REGISTRY.histogram('http_request_duration_seconds', 'Time to produce a response',
+                                   ('app', 'route', 'method'))
+HTTP_IN_PROGRESS = REGISTRY.gauge('http_requests_in_progress', 'Requests being handled', ('app',))
+REQUEST_STATEMENTS = REGISTRY.histogram('http_request_db_statements', 'SQL statements run per request',
+                                        ('app', 'route'), STATEMENT_BUCKETS)
+REQUEST_DB_TIME = REGISTRY.histogram('http_request_db_seconds', 'Time spent in SQLite per request',
+                                     ('app', 'route'))
+DB_STATEMENT_DURATION = REGISTRY.histogram('db_statement_duration_seconds',
+                                           'SQL statement time by leading keyword', ('verb',))
+DB_CONNECTION_HOLD = REGISTRY.histogram('db_connection_hold_seconds', 'Time a pooled connection stays checked out')
+DB_BUSY = REGISTRY.counter('db_busy_errors_total', 'Statements that failed with SQLITE_BUSY or SQLITE_LOCKED',
+                           ('verb',))
+
+_local = threading.local()
+
+
+class RequestStats:
+    __slots__ = ('started', 'statements', 'db_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+
+
+def _verb(sql):
+    verb = sql.lstrip()[:8].split(None, 1)
+    verb = verb[0].upper() if verb else ''
+    return verb if verb in VERBS else 'OTHER'
+
+
+def _record_statement(verb, elapsed):
+    DB_STATEMENT_DURATION.observe(elapsed, (verb,))
+    stats = getattr(_local, 'request', None)
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+
+
+def _is_busy(error):
+    name = getattr(error, 'sqlite_errorname', '')
+    return name in ('SQLITE_BUSY', 'SQLITE_LOCKED') or 'locked' in str(error)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that times execute, executemany and commit.
+
+    The time of a SELECT covers preparing it and stepping to the first row;
+    later fetches are not included.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if _is_busy(e):
+                DB_BUSY.inc((_verb(sql),))
+            raise
+        finally:
+            _record_statement(_verb(sql), time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if _is_busy(e):
+                DB_BUSY.inc((_verb(sql),))
+            raise
+        finally:
+            _record_statement(_verb(sql), time.perf_counter() - started)
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        except sqlite3.OperationalError as e:
+            if _is_busy(e):
+                DB_BUSY.inc(('COMMIT',))
+            raise
+        finally:
+            _record_statement('COMMIT', time.perf_counter() - started)
+
+
+def instrument_app(app, name):
+    """Time every request of a Flask app, with the SQL it ran on its thread"""
+
+    def finish(status):
+        stats = _local.request
+        _local.request = None
+        elapsed = time.perf_counter() - stats.started
+        rule = current_request.url_rule
+        route = rule.rule if rule else 'unmatched'
+        method = current_request.method
+        HTTP_REQUESTS.inc((name, route, method, str(status)))
+        HTTP_DURATION.observe(elapsed, (name, route, method))
+        REQUEST_STATEMENTS.observe(stats.statements, (name, route))
+        REQUEST_DB_TIME.observe(stats.db_time, (name, route))
+        HTTP_IN_PROGRESS.dec((name,))
+
+    @app.before_request
+    def start_request_timer():
+        _local.request = RequestStats()
+        HTTP_IN_PROGRESS.inc((name,))
+
+    @app.after_request
+    def stop_request_timer(response):
+        if getattr(_local, 'request', None) is not None:
+            finish(response.status_code)
+        return response
+
+    @app.teardown_request
+    def stop_failed_request_timer(exc):
+        # after_request does not run when a view raises
+        if getattr(_local, 'request', None) is not None:
+            finish(500)
+
+
+def watch_waitress(server, registry=REGISTRY):
+    """Report waitress's task queue: requests accepted but waiting for a thread"""
+    dispatcher = server.task_dispatcher
+
+    def collect():
+        return [
+            (f'{registry.prefix}waitress_queue_depth', 'gauge', 'Requests waiting for a waitress thread',
+             [(f'{registry.prefix}waitress_queue_depth', {}, len(dispatcher.queue))]),
+            (f'{registry.prefix}waitress_active_threads', 'gauge', 'Waitress threads handling a request',
+             [(f'{registry.prefix}waitress_active_threads', {}, dispatcher.active_count)]),
+            (f'{registry.prefix}waitress_threads', 'gauge', 'Waitress worker threads',
+             [(f'{registry.prefix}waitress_threads', {}, len(dispatcher.threads))]),
+        ]
+    registry.register(collect)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(snapshots):
+    """Prometheus text format for [(extra_labels, families)], merging families by name"""
+    merged = {}
+    for extra, families in snapshots:
+        for name, kind, help, samples in families:
+            family = merged.setdefault(name, (kind, help, []))
+            family[2].extend((sample, dict(labels, **extra), value) for sample, labels, value in samples)
+
+    lines = []
+    for name, (kind, help, samples) in merged.items():
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for sample, labels, value in samples:
+            if labels:
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f'{sample}{{{label_text}}} {value}')
+            else:
+                lines.append(f'{sample} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class WorkerSnapshots:
+    """Shares metrics between worker processes through snapshot files.
+
+    Each worker writes its collected families to <directory>/<worker>.json
+    every interval seconds (and on every scrape it serves), and a scrape
+    renders all recent snapshots with a worker label, so whichever worker
+    answers /metrics reports the whole server.
+    """
+
+    def __init__(self, registry, directory, worker, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.worker = worker
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-snapshot', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def write(self):
+        families = self.registry.collect()
+        path = os.path.join(self.directory, f'{self.worker}.json')
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(families, f, separators=(',', ':'))
+        os.replace(tmp, path)
+        return families
+
+    def read_all(self):
+        snapshots = [({'worker': str(self.worker)}, self.write())]
+        # Snapshots this old belong to workers that are gone
+        cutoff = time.time() - 3 * self.interval
+        for entry in os.scandir(self.directory):
+            worker, ext = os.path.splitext(entry.name)
+            if ext != '.json' or worker == str(self.worker):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    continue
+                with open(entry.path, encoding='utf-8') as f:
+                    snapshots.append(({'worker': worker}, json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                logger.error(f"Metrics snapshot error: {e}")
+
+
+def metrics_allowed(request, token):
+    """With a token configured require it as a bearer token; otherwise only local scrapes"""
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        return hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode())
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+
+def add_endpoint(app, token, snapshots=None):
+    """Serve the registry (or all workers' snapshots) at /metrics"""
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if not metrics_allowed(current_request, token):
+            return app.response_class('Forbidden\n', status=403, mimetype='text/plain')
+        if snapshots is not None:
+            body = render(snapshots.read_all())
+        else:
+            body = render([({}, REGISTRY.collect())])
+        return app.response_class(body, content_type=CONTENT_TYPE)
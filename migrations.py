@@ -0,0 +1,348 @@
+import sqlite3
+import logging
+from config import Config
+from question_bank import question_hash
+from answer_sheets import pack, unpack, ANSWERS_VIEW, ANSWERS_DELETE_TRIGGER
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_exam_questions(conn):
+    """Move active_exams.question_ids (comma-joined TEXT) into exam_questions rows"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS exam_questions (
+        exam_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        question_id INTEGER NOT NULL,
+        PRIMARY KEY (exam_id, position),
+        FOREIGN KEY (exam_id) REFERENCES active_exams(id),
+        FOREIGN KEY (question_id) REFERENCES questions(id)
+    ) WITHOUT ROWID''')
+
+    rows = conn.execute('SELECT id, question_ids FROM active_exams').fetchall()
+    conn.executemany('INSERT INTO exam_questions (exam_id, position, question_id) VALUES (?, ?, ?)',
+                     ((exam_id, position, int(qid))
+                      for exam_id, question_ids in rows
+                      for position, qid in enumerate(question_ids.split(','))
+                      if qid))
+
+    # Rebuild active_exams without the old column (ALTER TABLE DROP COLUMN needs SQLite 3.35)
+    conn.execute('''CREATE TABLE active_exams_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER UNIQUE NOT NULL,
+        started_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''')
+    conn.execute('INSERT INTO active_exams_new (id, user_id, started_at) SELECT id, user_id, started_at FROM active_exams')
+    conn.execute('DROP TABLE active_exams')
+    conn.execute('ALTER TABLE active_exams_new RENAME TO active_exams')
+
+
+
+def _hash_questions(conn):
+    """Add questions.content_hash and fill it in for the existing bank"""
+    conn.execute('ALTER TABLE questions ADD COLUMN content_hash TEXT')
+    rows = conn.execute('SELECT id, question, option_a, option_b, option_c, option_d FROM questions').fetchall()
+    conn.executemany('UPDATE questions SET content_hash = ? WHERE id = ?',
+                     ((question_hash(*r[1:]), r[0]) for r in rows))
+    # Not UNIQUE: banks built by re-running add_sample_data already hold duplicates
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_questions_content_hash ON questions (content_hash)')
+
+def _pack_answers(conn):
+    """Replace the row-per-answer answers table with one packed answer_sheets
+    row per submission, leaving an answers view with the old columns"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS answer_sheets (
+        user_id INTEGER PRIMARY KEY,
+        question_ids BLOB NOT NULL,
+        choices BLOB NOT NULL,
+        answered BLOB NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''')
+
+    def sheets():
+        user_id, answers = None, []
+        # Row ids follow insertion order, which is the order the exam was taken in
+        for uid, qid, selected in conn.execute('SELECT user_id, question_id, selected_answer FROM answers ORDER BY user_id, id'):
+            if uid != user_id and answers:
+                yield (user_id, *pack(answers))
+                answers = []
+            user_id = uid
+            answers.append((qid, selected))
+        if answers:
+            yield (user_id, *pack(answers))
+
+    conn.executemany('INSERT OR REPLACE INTO answer_sheets (user_id, question_ids, choices, answered) VALUES (?, ?, ?, ?)',
+                     list(sheets()))
+    conn.execute('DROP TABLE answers')
+    conn.execute(ANSWERS_VIEW)
+    conn.execute(ANSWERS_DELETE_TRIGGER)
+
+def _split_answer_sheets(conn):
+    """Key answer_sheets by result instead of by student.
+
+    Migration 9 packed all of a student's answers into one sheet, and a
+    submission after an attempt reset replaced it, while results kept every
+    attempt. The sheets are cut back into attempts by each result's
+    total_questions, latest first; a replaced sheet only covers the latest
+    attempt, and answers left over match no result.
+    """
+    conn.execute('DROP VIEW IF EXISTS answers')
+    conn.execute('''CREATE TABLE answer_sheets_new (
+        result_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        question_ids BLOB NOT NULL,
+        choices BLOB NOT NULL,
+        answered BLOB NOT NULL,
+        FOREIGN KEY (result_id) REFERENCES results(id),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''')
+
+    attempts = {}
+    for result_id, user_id, total in conn.execute('SELECT id, user_id, total_questions FROM results ORDER BY id'):
+        attempts.setdefault(user_id, []).append((result_id, total))
+
+    def sheets():
+        unmatched = 0
+        for user_id, question_ids, choices, answered in conn.execute(
+                'SELECT user_id, question_ids, choices, answered FROM answer_sheets').fetchall():
+            answers = unpack(question_ids, choices, answered)
+            end = len(answers)
+            for result_id, total in reversed(attempts.get(user_id, [])):
+                if total > end:
+                    break
+                yield (result_id, user_id, *pack(answers[end - total:end]))
+                end -= total
+            unmatched += end
+        if unmatched:
+            logger.warning(f"{unmatched} stored answers match no result and were not kept")
+
+    conn.executemany('INSERT INTO answer_sheets_new (result_id, user_id, question_ids, choices, answered) VALUES (?, ?, ?, ?, ?)',
+                     list(sheets()))
+    conn.execute('DROP TABLE answer_sheets')
+    conn.execute('ALTER TABLE answer_sheets_new RENAME TO answer_sheets')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_answer_sheets_user ON answer_sheets (user_id)')
+    conn.execute(ANSWERS_VIEW)
+    conn.execute(ANSWERS_DELETE_TRIGGER)
+
+# Each migration is (version, description, statements). Versions are applied
+# in order inside their own transaction and recorded in PRAGMA user_version.
+# Never edit a migration that has shipped; append a new one instead.
+MIGRATIONS = [
+    (1, 'Base schema', [
+        '''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL,
+            attempted INTEGER DEFAULT 0
+        )''',
+        '''CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT NOT NULL,
+            option_a TEXT NOT NULL,
+            option_b TEXT NOT NULL,
+            option_c TEXT NOT NULL,
+            option_d TEXT NOT NULL,
+            correct_answer TEXT NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            selected_answer TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (question_id) REFERENCES questions(id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ip_address TEXT,
+            score INTEGER NOT NULL,
+            total_questions INTEGER NOT NULL,
+            submitted_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS exam_settings (
+            id INTEGER PRIMARY KEY,
+            duration_minutes INTEGER DEFAULT 30,
+            questions_per_exam INTEGER DEFAULT 10
+        )''',
+        '''CREATE TABLE IF NOT EXISTS tab_switches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ip_address TEXT,
+            switch_count INTEGER,
+            timestamp TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS user_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ip_address TEXT,
+            login_time TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            logout_time TIMESTAMP,
+            is_active INTEGER DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS active_exams (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL,
+            question_ids TEXT NOT NULL,
+            started_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )''',
+    ]),
+    (2, 'Indexes for hot lookup columns', [
+        # MAX(switch_count) ... WHERE user_id = ? is answered from the index alone
+        'CREATE INDEX IF NOT EXISTS idx_tab_switches_user ON tab_switches (user_id, switch_count)',
+        'CREATE INDEX IF NOT EXISTS idx_user_sessions_user_active ON user_sessions (user_id, is_active)',
+        'CREATE INDEX IF NOT EXISTS idx_user_sessions_login_time ON user_sessions (login_time)',
+        'CREATE INDEX IF NOT EXISTS idx_results_rank ON results (score DESC, submitted_at, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_results_user ON results (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_answers_user ON answers (user_id, question_id, selected_answer)',
+    ]),
+    (3, 'Normalize active_exams.question_ids into exam_questions', [
+        _normalize_exam_questions,
+    ]),
+    (4, 'Pre-generated exam papers', [
+        '''CREATE TABLE IF NOT EXISTS exam_papers (
+            user_id INTEGER PRIMARY KEY,
+            seed INTEGER NOT NULL,
+            bank_version INTEGER,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS paper_questions (
+            user_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, position),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (question_id) REFERENCES questions(id)
+        ) WITHOUT ROWID''',
+    ]),
+    (5, 'Change log for the admin live feed', [
+        '''CREATE TABLE IF NOT EXISTS change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            user_id INTEGER,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+        )''',
+    ]),
+    (6, 'Content hashes for question de-duplication', [
+        _hash_questions,
+    ]),
+    (7, 'Server-side sessions', [
+        '''CREATE TABLE IF NOT EXISTS web_sessions (
+            sid TEXT PRIMARY KEY,
+            user_id INTEGER,
+            ip_address TEXT,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_web_sessions_expires ON web_sessions (expires_at)',
+        'CREATE INDEX IF NOT EXISTS idx_web_sessions_user ON web_sessions (user_id)',
+        # Lets the sweeper and the admin counters touch only open log rows
+        'CREATE INDEX IF NOT EXISTS idx_user_sessions_open ON user_sessions (user_id) WHERE is_active = 1',
+    ]),
+    (8, 'State shared between worker processes', [
+        '''CREATE TABLE IF NOT EXISTS rate_limits (
+            bucket TEXT NOT NULL,
+            key TEXT NOT NULL,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (bucket, key)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS submission_claims (
+            user_id INTEGER PRIMARY KEY,
+            worker INTEGER NOT NULL,
+            receipt TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_submission_claims_worker ON submission_claims (worker)',
+    ]),
+    (9, 'One packed answer sheet per submission', [
+        _pack_answers,
+    ]),
+    (10, 'Autosaved answers of exams in progress', [
+        '''CREATE TABLE IF NOT EXISTS answer_drafts (
+            user_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            selected_answer TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            PRIMARY KEY (user_id, question_id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        ) WITHOUT ROWID''',
+    ]),
+    (11, 'One answer sheet per result, not per student', [
+        _split_answer_sheets,
+    ]),
+]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """Apply pending migrations and return the list of versions applied.
+
+    Safe to call from several processes at once: each migration runs under
+    BEGIN IMMEDIATE and re-checks the version after taking the write lock.
+    """
+    if current_version(conn) >= latest_version():
+        return []
+
+    if conn.in_transaction:
+        conn.commit()
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Migration {version} ({description}) failed")
+            raise
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+
+    if applied:
+        # Refresh planner statistics so the new indexes get used
+        conn.execute('ANALYZE')
+        conn.commit()
+    return applied
+
+
+def migrate_path(db_path=None):
+    conn = sqlite3.connect(db_path or Config.DB_PATH)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    applied = migrate_path()
+    print(f"Database at version {latest_version()} ({len(applied)} migrations applied)")
@@ -0,0 +1,128 @@
+import json
+import random
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Paper = namedtuple('Paper', ['bank_version', 'question_ids'])
+
+
+def question_to_dict(q):
+    """Student-facing view of a cached question (no correct answer)"""
+    return {
+        'id': q.id,
+        'question': q.question,
+        'options': dict(zip('ABCD', q.options))
+    }
+
+
+def serialize_questions(questions):
+    return json.dumps([question_to_dict(q) for q in questions], separators=(',', ':'))
+
+
+def draw_questions(rng, questions, count, stratified=False):
+    """Pick count questions from the id-ordered bank.
+
+    Stratified draws split the bank into count contiguous strata and take
+    one question from each, so every paper covers the whole bank evenly
+    (questions are usually entered topic by topic).
+    """
+    if not stratified:
+        return rng.sample(questions, count)
+
+    total = len(questions)
+    picks = [questions[rng.randrange(i * total // count, (i + 1) * total // count)]
+             for i in range(count)]
+    rng.shuffle(picks)
+    return picks
+
+
+def generate_papers(conn, bank, count, seed=None, stratified=False, overwrite=False):
+    """Assign a paper to every student who has not started or attempted the exam.
+
+    Each student's draw uses its own RNG seeded from (seed, user id), so a
+    paper can be reproduced from the seed regardless of generation order.
+    Runs as one bulk transaction; returns (papers generated, seed used).
+    """
+    if len(bank) < count:
+        raise ValueError('Not enough questions in database')
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 31)
+
+    query = '''SELECT u.id FROM users u
+               WHERE u.role = 'student' AND u.attempted = 0
+               AND NOT EXISTS (SELECT 1 FROM active_exams a WHERE a.user_id = u.id)'''
+    if not overwrite:
+        query += ' AND NOT EXISTS (SELECT 1 FROM exam_papers p WHERE p.user_id = u.id)'
+
+    conn.execute('BEGIN IMMEDIATE')
+    user_ids = [r[0] for r in conn.execute(query).fetchall()]
+
+    paper_rows = []
+    question_rows = []
+    for user_id in user_ids:
+        rng = random.Random(f'{seed}:{user_id}')
+        questions = draw_questions(rng, bank.questions, count, stratified)
+        paper_rows.append((user_id, seed, bank.version, serialize_questions(questions)))
+        question_rows.extend((user_id, position, q.id) for position, q in enumerate(questions))
+
+    if overwrite:
+        conn.executemany('DELETE FROM paper_questions WHERE user_id = ?', ((uid,) for uid in user_ids))
+        conn.executemany('DELETE FROM exam_papers WHERE user_id = ?', ((uid,) for uid in user_ids))
+    conn.executemany('INSERT INTO exam_papers (user_id, seed, bank_version, payload) VALUES (?, ?, ?, ?)',
+                     paper_rows)
+    conn.executemany('INSERT INTO paper_questions (user_id, position, question_id) VALUES (?, ?, ?)',
+                     question_rows)
+    return len(paper_rows), seed
+
+
+def load_paper(conn, user_id):
+    row = conn.execute('SELECT bank_version FROM exam_papers WHERE user_id = ?', (user_id,)).fetchone()
+    if row is None:
+        return None
+    question_ids = [r[0] for r in conn.execute(
+        'SELECT question_id FROM paper_questions WHERE user_id = ? ORDER BY position', (user_id,))]
+    return Paper(row['bank_version'], question_ids)
+
+
+def paper_is_current(paper, bank, count):
+    """Whether a stored paper still fits the exam: the configured length, and no deleted questions.
+
+    Edited questions are fine, the payload is re-encoded from the bank when
+    its version has moved on.
+    """
+    return len(paper.question_ids) == count and all(qid in bank.by_id for qid in paper.question_ids)
+
+
+def count_stale_papers(conn, count):
+    """Papers that paper_is_current would reject for an exam of count questions"""
+    return conn.execute('''SELECT COUNT(*) FROM exam_papers p
+                            WHERE (SELECT COUNT(*) FROM paper_questions pq WHERE pq.user_id = p.user_id) != ?
+                            OR EXISTS (SELECT 1 FROM paper_questions pq
+                                       LEFT JOIN questions q ON q.id = pq.question_id
+                                       WHERE pq.user_id = p.user_id AND q.id IS NULL)''',
+                        (count,)).fetchone()[0]
+
+
+def load_paper_payload(conn, user_id):
+    row = conn.execute('SELECT payload FROM exam_papers WHERE user_id = ?', (user_id,)).fetchone()
+    return row['payload'] if row else None
+
+
+def start_paper(conn, user_id):
+    """Open a user's active exam from their pre-generated paper"""
+    exam_id = conn.execute('INSERT INTO active_exams (user_id) VALUES (?)', (user_id,)).lastrowid
+    conn.execute('''INSERT INTO exam_questions (exam_id, position, question_id)
+                    SELECT ?, position, question_id FROM paper_questions WHERE user_id = ?''',
+                 (exam_id, user_id))
+    return exam_id
+
+
+def delete_papers(conn, user_id=None):
+    if user_id is None:
+        conn.execute('DELETE FROM paper_questions')
+        conn.execute('DELETE FROM exam_papers')
+    else:
+        conn.execute('DELETE FROM paper_questions WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM exam_papers WHERE user_id = ?', (user_id,))
@@ -0,0 +1,129 @@
+import os
+import hmac
+import hashlib
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMES = ('scrypt', 'pbkdf2_sha256', 'sha256')
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 260000
+SALT_BYTES = 16
+
+
+def _default_scheme():
+    scheme = Config.PASSWORD_HASH
+    if scheme == 'scrypt' and not hasattr(hashlib, 'scrypt'):
+        # Python built against an OpenSSL without scrypt
+        return 'pbkdf2_sha256'
+    return scheme
+
+
+def hash_password(password, scheme=None):
+    """Encode a password as '<scheme>$<params>$<salt>$<hash>' (legacy sha256 stays bare hex)"""
+    scheme = scheme or _default_scheme()
+    if scheme == 'sha256':
+        return hashlib.sha256(password.encode()).hexdigest()
+
+    salt = os.urandom(SALT_BYTES)
+    if scheme == 'scrypt':
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}'
+    if scheme == 'pbkdf2_sha256':
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PBKDF2_ITERATIONS)
+        return f'pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}'
+    raise ValueError(f'Unknown password hash scheme: {scheme}')
+
+
+def verify_password(password, stored):
+    if not stored:
+        return False
+    parts = stored.split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            expected = bytes.fromhex(parts[5])
+            digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(parts[4]), n=n, r=r, p=p,
+                                    maxmem=256 * n * r + 1024 * 1024, dklen=len(expected))
+        elif parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            expected = bytes.fromhex(parts[3])
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(parts[2]), int(parts[1]),
+                                         dklen=len(expected))
+        elif len(parts) == 1:
+            return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+        else:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest, expected)
+
+
+_dummy_hash = None
+
+
+def dummy_hash():
+    """Hash of a random password in the configured scheme, to verify against
+    when the username is unknown so the reply takes as long as for a real one"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(os.urandom(SALT_BYTES).hex())
+    return _dummy_hash
+
+
+def needs_rehash(stored, scheme=None):
+    """True when a hash was made with a different scheme than the configured one"""
+    scheme = scheme or _default_scheme()
+    current = 'sha256' if '$' not in stored else stored.split('$', 1)[0]
+    return current != scheme
+
+
+class PasswordHasher:
+    """Bounded thread pool for password hashing.
+
+    scrypt and PBKDF2 release the GIL, so a few threads use a few cores while
+    a login storm queues here instead of every waitress thread hashing at
+    once and starving the exam endpoints.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+
+    def verify(self, password, stored, timeout=None):
+        return self._executor.submit(verify_password, password, stored).result(timeout)
+
+    def hash(self, password, timeout=None):
+        return self._executor.submit(hash_password, password).result(timeout)
+
+    def hash_later(self, password, callback):
+        """Hash in the background and pass the result to callback"""
+        def done(future):
+            try:
+                callback(future.result())
+            except Exception as e:
+                logger.error(f"Background password hash error: {e}")
+        self._executor.submit(hash_password, password).add_done_callback(done)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                # Worker processes share the CPUs between them
+                _hasher = PasswordHasher(Config.PASSWORD_HASH_WORKERS or
+                                         max(1, (os.cpu_count() or 1) // Config.WORKERS))
+    return _hasher
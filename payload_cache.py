@@ -0,0 +1,64 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 512
+
+Payload = namedtuple('Payload', ['etag', 'raw', 'gzip', 'br'])
+
+
+def payload_key(question_ids, bank_version, duration):
+    return (tuple(question_ids), bank_version, duration)
+
+
+def build_payload(key, body):
+    """Encode an exam body once, keeping identity, gzip and brotli variants"""
+    raw = body.encode('utf-8') if isinstance(body, str) else body
+    etag = hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+    compressed = gzip.compress(raw, 6) if len(raw) >= MIN_COMPRESS_SIZE else None
+    br = brotli.compress(raw) if brotli and len(raw) >= MIN_COMPRESS_SIZE else None
+    return Payload(etag, raw, compressed, br)
+
+
+class PayloadCache:
+    """Bounded LRU of encoded /api/exam/start bodies.
+
+    Keys are (question ids, bank version, duration), so any question or
+    settings edit produces new keys and old entries simply age out.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body):
+        entry = build_payload(key, body)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,249 @@
+import io
+import os
+import csv
+import json
+import sqlite3
+import hashlib
+import argparse
+from contextlib import nullcontext
+from config import Config
+from question_cache import bump_version, QUESTIONS
+from exports import chunked, PAGE_SIZE
+
+FORMATS = ('csv', 'json')
+FIELDS = ['question', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer']
+MAX_LENGTHS = {'question': 500, 'option_a': 200, 'option_b': 200, 'option_c': 200, 'option_d': 200}
+
+# Questions written per transaction during an import
+BATCH_SIZE = 500
+# SQLite caps the number of bound parameters per statement
+LOOKUP_CHUNK = 500
+
+
+def _normalize(text):
+    return ' '.join(text.split()).casefold()
+
+
+def question_hash(question, option_a, option_b, option_c, option_d):
+    """Content hash used to spot duplicates: case and whitespace are ignored,
+    option order is not (the correct answer refers to a position)"""
+    text = '\x1f'.join(_normalize(t) for t in (question, option_a, option_b, option_c, option_d))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def clean_question(record):
+    """Validated field tuple in FIELDS order, or None if the record is unusable"""
+    if not isinstance(record, dict):
+        return None
+    values = []
+    for field in FIELDS[:-1]:
+        value = record.get(field)
+        if not value or not isinstance(value, str) or not value.strip():
+            return None
+        values.append(value.strip()[:MAX_LENGTHS[field]])
+    correct = record.get('correct_answer')
+    if not isinstance(correct, str) or correct.strip().upper() not in ('A', 'B', 'C', 'D'):
+        return None
+    values.append(correct.strip().upper())
+    return tuple(values)
+
+
+def parse_csv(stream):
+    """Yield (line, record) from a CSV in FIELDS order; a header row is optional"""
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    try:
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            if reader.line_num == 1 and [c.strip().lower() for c in row[:len(FIELDS)]] == FIELDS:
+                continue
+            yield reader.line_num, dict(zip(FIELDS, row))
+    except csv.Error as e:
+        raise ValueError(f'Invalid CSV on line {reader.line_num}: {e}')
+
+
+def parse_json(stream):
+    """Yield (line, record) from NDJSON, or from a JSON array (numbered by position)"""
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    for line_no, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith('['):
+            try:
+                records = json.loads(line + lines.read())
+            except ValueError:
+                raise ValueError('Invalid JSON')
+            if not isinstance(records, list):
+                raise ValueError('Invalid JSON')
+            yield from enumerate(records, 1)
+            return
+        try:
+            yield line_no, json.loads(stripped)
+        except ValueError:
+            yield line_no, None
+
+
+def parse_upload(stream, fmt):
+    if fmt not in FORMATS:
+        raise ValueError('Unsupported format')
+    return parse_csv(stream) if fmt == 'csv' else parse_json(stream)
+
+
+class ImportStopped(ValueError):
+    """An upload turned out to be invalid partway through; report holds what
+    earlier batches had already committed"""
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+def existing_hashes(conn, hashes):
+    found = set()
+    for i in range(0, len(hashes), LOOKUP_CHUNK):
+        chunk = hashes[i:i + LOOKUP_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        found.update(r[0] for r in conn.execute(
+            f'SELECT content_hash FROM questions WHERE content_hash IN ({placeholders})', chunk))
+    return found
+
+
+def import_questions(conn, records, batch_size=BATCH_SIZE):
+    """Insert (line, record) questions in batched transactions, skipping duplicates.
+
+    A question is a duplicate if its content hash matches one already in the
+    bank or earlier in the same upload. Each batch commits on its own and
+    bumps the question cache version. Returns the report dict; if the
+    upload proves invalid partway, raises ImportStopped with the report of
+    the batches already committed (re-importing the fixed file skips them
+    as duplicates).
+    """
+    report = {'created': 0, 'skipped': []}
+    seen = set()
+    batch = []
+
+    def write(batch):
+        conn.execute('BEGIN IMMEDIATE')
+        taken = existing_hashes(conn, [row[-1] for _, row in batch])
+        rows = []
+        for line_no, row in batch:
+            if row[-1] in taken:
+                report['skipped'].append({'line': line_no, 'message': 'Duplicate question'})
+            else:
+                rows.append(row)
+        conn.executemany('''INSERT INTO questions
+                            (question, option_a, option_b, option_c, option_d, correct_answer, content_hash)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+        if rows:
+            bump_version(conn, QUESTIONS)
+        conn.commit()
+        report['created'] += len(rows)
+
+    try:
+        for line_no, record in records:
+            values = clean_question(record)
+            if values is None:
+                report['skipped'].append({'line': line_no, 'message': 'Invalid input'})
+                continue
+            content_hash = question_hash(*values[:5])
+            if content_hash in seen:
+                report['skipped'].append({'line': line_no, 'message': 'Duplicate question in upload'})
+                continue
+            seen.add(content_hash)
+            batch.append((line_no, values + (content_hash,)))
+            if len(batch) >= batch_size:
+                write(batch)
+                batch = []
+    except ValueError as e:
+        report['skipped'].sort(key=lambda s: s['line'])
+        if report['created']:
+            raise ImportStopped(f"{e}; import stopped partway after adding {report['created']} questions",
+                                report)
+        raise ImportStopped(str(e), report)
+    if batch:
+        write(batch)
+
+    report['skipped'].sort(key=lambda s: s['line'])
+    return report
+
+
+def question_rows(connect, page_size=PAGE_SIZE):
+    """Questions in id order as FIELDS tuples, read a page at a time.
+
+    Each page takes its own connection, so a slow download never holds a
+    pooled connection or an open read snapshot between pages.
+    """
+    after = 0
+    while True:
+        with connect() as conn:
+            rows = conn.execute(f'''SELECT id, {", ".join(FIELDS)} FROM questions
+                                    WHERE id > ? ORDER BY id LIMIT ?''', (after, page_size)).fetchall()
+        for r in rows:
+            yield tuple(r[1:])
+        if len(rows) < page_size:
+            return
+        after = rows[-1][0]
+
+
+def question_lines(rows, fmt):
+    if fmt == 'json':
+        # A JSON array, one question per line, so it imports as either form
+        yield '['
+        first = True
+        for r in rows:
+            yield ('\n' if first else ',\n') + json.dumps(dict(zip(FIELDS, r)), ensure_ascii=False)
+            first = False
+        yield '\n]\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for r in rows:
+        writer.writerow(r)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_questions(connect, fmt='csv'):
+    """Yield the question bank as byte chunks in an importable format"""
+    return chunked(question_lines(question_rows(connect), fmt))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import or export the question bank')
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=FORMATS, help='default: from the file extension')
+    parser.add_argument('--db', help=f'database path (default: {Config.DB_PATH})')
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('json' if os.path.splitext(args.file)[1].lower() in ('.json', '.ndjson') else 'csv')
+    conn = sqlite3.connect(args.db or Config.DB_PATH)
+    try:
+        if args.action == 'export':
+            with open(args.file, 'wb') as f:
+                for chunk in chunked(question_lines(question_rows(lambda: nullcontext(conn)), fmt)):
+                    f.write(chunk)
+            print(f"Exported {conn.execute('SELECT COUNT(*) FROM questions').fetchone()[0]} questions")
+            return
+
+        try:
+            with open(args.file, 'rb') as f:
+                report = import_questions(conn, parse_upload(f, fmt))
+        except ValueError as e:
+            conn.rollback()
+            raise SystemExit(f"Import failed: {e}")
+    finally:
+        conn.close()
+
+    for s in report['skipped']:
+        print(f"Line {s['line']}: {s['message']}")
+    print(f"Created {report['created']} questions, skipped {len(report['skipped'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+QUESTIONS = 'questions'
+SETTINGS = 'exam_settings'
+USERS = 'users'
+
+CachedQuestion = namedtuple('CachedQuestion', ['id', 'question', 'options', 'correct_answer'])
+ExamSettings = namedtuple('ExamSettings', ['duration_minutes', 'questions_per_exam'])
+
+
+def bump_version(conn, name):
+    """Mark a cached table as changed; call inside the writing transaction"""
+    conn.execute('''INSERT INTO cache_versions (name, version) VALUES (?, 1)
+                    ON CONFLICT(name) DO UPDATE SET version = version + 1''', (name,))
+
+
+def read_version(conn, name):
+    try:
+        row = conn.execute('SELECT version FROM cache_versions WHERE name = ?', (name,)).fetchone()
+    except sqlite3.OperationalError:
+        # Database predates cache_versions; never trust the cache
+        return None
+    return row[0] if row else 0
+
+
+class QuestionBank:
+    """Immutable snapshot of the question bank at a given version"""
+
+    def __init__(self, version, questions):
+        self.version = version
+        self.questions = tuple(questions)
+        self.by_id = {q.id: q for q in self.questions}
+        self.answer_key = {q.id: q.correct_answer for q in self.questions}
+
+    def __len__(self):
+        return len(self.questions)
+
+
+class ExamCache:
+    """Process-local cache of the question bank and exam settings.
+
+    Each lookup costs one primary-key read of cache_versions; the full
+    tables are only re-read after an admin edit bumps their version.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bank = None
+        self._settings = None
+        self._settings_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_bank(self, conn):
+        version = read_version(conn, QUESTIONS)
+        bank = self._bank
+        if bank is not None and version is not None and bank.version == version:
+            self.hits += 1
+            return bank
+
+        with self._lock:
+            bank = self._bank
+            if bank is None or version is None or bank.version != version:
+                rows = conn.execute('''SELECT id, question, option_a, option_b, option_c, option_d, correct_answer
+                                       FROM questions ORDER BY id''').fetchall()
+                bank = QuestionBank(version, (
+                    CachedQuestion(r['id'], r['question'],
+                                   (r['option_a'], r['option_b'], r['option_c'], r['option_d']),
+                                   r['correct_answer'])
+                    for r in rows))
+                self._bank = bank
+                self.misses += 1
+                logger.info(f"Loaded question bank version {version} ({len(bank)} questions)")
+            else:
+                self.hits += 1
+        return bank
+
+    def get_settings(self, conn):
+        version = read_version(conn, SETTINGS)
+        settings = self._settings
+        if settings is not None and version is not None and self._settings_version == version:
+            self.hits += 1
+            return settings
+
+        with self._lock:
+            row = conn.execute('SELECT duration_minutes, questions_per_exam FROM exam_settings WHERE id = 1').fetchone()
+            settings = ExamSettings(row['duration_minutes'], row['questions_per_exam'])
+            self._settings = settings
+            self._settings_version = version
+            self.misses += 1
+        return settings
+
+
+exam_cache = ExamCache()
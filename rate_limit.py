@@ -0,0 +1,151 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Token buckets per key: capacity attempts, refilled evenly over window seconds.
+
+    Each check is O(1). Keys live in an LRU capped at max_keys; evicting an
+    idle key only forgets its history, which at worst gives that key a
+    fresh bucket.
+    """
+
+    def __init__(self, capacity, window, max_keys=10000):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'consumed': 0, 'evictions': 0}
+
+    def _tokens(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        tokens, updated = bucket
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key):
+        """Seconds until key may try again (0 if it may now)"""
+        with self._lock:
+            tokens = self._tokens(key, time.monotonic())
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[key] = (max(0.0, self._tokens(key, now) - 1), now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.stats['evictions'] += 1
+            self.stats['consumed'] += 1
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SharedRateLimiter:
+    """RateLimiter with its buckets in the rate_limits table.
+
+    Used when several worker processes serve the same app, so a client
+    cannot multiply its attempts by landing on different workers. A check
+    is one primary-key read; only consume() writes. Buckets that have
+    refilled completely are pruned every PRUNE_EVERY writes.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, connect, bucket, capacity, window):
+        self.connect = connect
+        self.bucket = bucket
+        self.capacity = capacity
+        self.rate = capacity / window
+        self._lock = threading.Lock()
+        self.stats = {'consumed': 0, 'evictions': 0}
+
+    def retry_after(self, key):
+        with self.connect() as conn:
+            row = conn.execute('SELECT tokens, updated FROM rate_limits WHERE bucket = ? AND key = ?',
+                               (self.bucket, key)).fetchone()
+        if row is None:
+            return 0
+        tokens = min(self.capacity, row[0] + (time.time() - row[1]) * self.rate)
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key):
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute('''INSERT INTO rate_limits (bucket, key, tokens, updated) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(bucket, key) DO UPDATE SET
+                            tokens = max(0.0, min(?, tokens + (excluded.updated - updated) * ?) - 1),
+                            updated = excluded.updated''',
+                         (self.bucket, key, self.capacity - 1, now, self.capacity, self.rate))
+            with self._lock:
+                self.stats['consumed'] += 1
+                prune = self.stats['consumed'] % self.PRUNE_EVERY == 0
+            if prune:
+                pruned = conn.execute('DELETE FROM rate_limits WHERE bucket = ? AND tokens + (? - updated) * ? >= ?',
+                                      (self.bucket, now, self.rate, self.capacity)).rowcount
+                with self._lock:
+                    self.stats['evictions'] += pruned
+            conn.commit()
+
+    def reset(self, key):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM rate_limits WHERE bucket = ? AND key = ?', (self.bucket, key))
+            conn.commit()
+
+    def __len__(self):
+        with self.connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM rate_limits WHERE bucket = ?', (self.bucket,)).fetchone()[0]
+
+
+class LoginLimiter:
+    """Failed-login limits per username and per client IP.
+
+    check() runs before any password work; only failed attempts use up
+    tokens, and a successful login clears its username's bucket. Pass
+    connect to keep the buckets in the database for multi-process serving.
+    """
+
+    def __init__(self, max_attempts, window, ip_max_attempts, max_keys=10000, connect=None):
+        if connect is None:
+            self.users = RateLimiter(max_attempts, window, max_keys)
+            self.ips = RateLimiter(ip_max_attempts, window, max_keys)
+        else:
+            self.users = SharedRateLimiter(connect, 'login_user', max_attempts, window)
+            self.ips = SharedRateLimiter(connect, 'login_ip', ip_max_attempts, window)
+        self.allowed = 0
+        self.blocked = 0
+
+    def check(self, username, ip_address):
+        """Seconds the caller must wait, or 0 if the attempt may proceed"""
+        wait = max(self.users.retry_after(username), self.ips.retry_after(ip_address))
+        if wait:
+            self.blocked += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def failed(self, username, ip_address):
+        self.users.consume(username)
+        self.ips.consume(ip_address)
+
+    def succeeded(self, username):
+        self.users.reset(username)
+
+    def stats(self):
+        return {
+            'allowed': self.allowed,
+            'blocked': self.blocked,
+            'failures': self.users.stats['consumed'],
+            'tracked_usernames': len(self.users),
+            'tracked_ips': len(self.ips),
+            'evictions': self.users.stats['evictions'] + self.ips.stats['evictions']
+        }
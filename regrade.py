@@ -0,0 +1,196 @@
+import threading
+import logging
+from datetime import datetime
+from change_log import latest_change_id, record_changes, RESULT
+from grading import tab_switch_penalty
+from question_cache import exam_cache
+from item_analysis import AnswerColumns, AVAILABLE, CODES, np
+from answer_sheets import read_result_sheets, sheet_question_ids, unpack
+
+logger = logging.getLogger(__name__)
+
+# Submissions read per query; also keeps IN (...) under SQLite's parameter limit
+CHUNK_SIZE = 500
+
+
+def raw_scores(sheets, answer_key):
+    """Number of correct answers per sheet from (key, question_ids, choices, answered) answer sheets"""
+    if AVAILABLE:
+        users, questions, choices = AnswerColumns.from_sheets(sheets)
+        if not len(users):
+            return {}
+        # Dense question id -> choice code table; -1 (deleted question) never matches
+        key = np.full(int(questions.max()) + 1, -1, dtype=np.int8)
+        for qid, letter in answer_key.items():
+            if qid < len(key):
+                key[qid] = CODES.get(letter, -1)
+        user_ids, inverse = np.unique(users, return_inverse=True)
+        right = np.bincount(inverse, weights=choices == key[questions])
+        return dict(zip(user_ids.tolist(), right.astype(int).tolist()))
+
+    return {user_id: sum(1 for qid, selected in unpack(*blobs) if selected and selected == answer_key.get(qid))
+            for user_id, *blobs in sheets}
+
+
+class Regrader:
+    """Rescores submitted exams in the background after an answer key edit.
+
+    Affected submissions are found from the question ids on each answer
+    sheet and read a chunk at a time, each chunk on a fresh read so live submissions are
+    never blocked. Scores are recomputed in memory against the current
+    answer key, less the tab-switch penalty as it stood at submit time,
+    and every changed score is written in one short transaction. Changes
+    to a student's latest result also go to change_log, so the leaderboard
+    and live dashboard follow; earlier attempts are rescored quietly.
+    Edits arriving while a regrade runs are queued and handled next.
+    """
+
+    def __init__(self, connect, chunk_size=CHUNK_SIZE):
+        self.connect = connect
+        self.chunk_size = chunk_size
+
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._status = {'state': 'idle'}
+        # change_log position a running job replays late results from
+        self._since = None
+
+        self.stats = {'jobs': 0, 'failures': 0, 'regraded': 0, 'changed': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='regrader', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def request(self, question_ids):
+        """Queue a regrade of every submission that answered any of question_ids"""
+        with self._lock:
+            self._pending.update(question_ids)
+            if self._status['state'] != 'running':
+                self._status = {'state': 'queued', 'question_ids': sorted(self._pending)}
+        self._wake.set()
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def last_change_id(self):
+        """change_log position the running job still reads from, or None when idle"""
+        return self._since
+
+    def _progress(self, **changes):
+        with self._lock:
+            self._status.update(changes)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                question_ids, self._pending = sorted(self._pending), set()
+            if not question_ids or self._stop.is_set():
+                continue
+            try:
+                self._regrade(question_ids)
+            except Exception as e:
+                self._since = None
+                self.stats['failures'] += 1
+                self._progress(state='failed', finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                logger.error(f"Regrade of questions {question_ids} failed: {e}")
+
+    def _affected(self, conn, question_ids):
+        edited = set(question_ids)
+        rows = conn.execute('''SELECT s.result_id, s.question_ids FROM answer_sheets s
+                               WHERE EXISTS (SELECT 1 FROM results r WHERE r.id = s.result_id)''')
+        return [result_id for result_id, ids in rows if not edited.isdisjoint(sheet_question_ids(ids))]
+
+    def _late(self, conn, after_id, seen):
+        """Results recorded after the job began, e.g. graded against the old
+        key just before the edit and written from the queue; a late result
+        is always its student's latest"""
+        rows = conn.execute('''SELECT r.id FROM results r
+                               WHERE r.user_id IN (SELECT user_id FROM change_log WHERE id > ? AND kind = ?)
+                               AND r.id = (SELECT MAX(l.id) FROM results l WHERE l.user_id = r.user_id)''',
+                            (after_id, RESULT))
+        return [r[0] for r in rows if r[0] not in seen]
+
+    def _rescore(self, conn, result_ids, answer_key):
+        """(result_id, user_id, latest, payload) for every result in result_ids whose stored score is now wrong"""
+        placeholders = ','.join('?' * len(result_ids))
+        right = raw_scores(read_result_sheets(conn, result_ids), answer_key)
+        # Switches logged after submitting did not count towards the original score
+        results = conn.execute(f'''SELECT r.id, r.user_id, r.ip_address, r.score, r.total_questions, r.submitted_at,
+                                          (SELECT MAX(t.switch_count) FROM tab_switches t
+                                           WHERE t.user_id = r.user_id AND t.timestamp <= r.submitted_at) AS max_switches,
+                                          r.id = (SELECT MAX(l.id) FROM results l WHERE l.user_id = r.user_id) AS latest
+                                   FROM results r
+                                   WHERE r.id IN ({placeholders})''', result_ids).fetchall()
+        changed = []
+        for r in results:
+            score = max(0, right.get(r['id'], 0) - tab_switch_penalty(r['max_switches']))
+            if score != r['score']:
+                changed.append((r['id'], r['user_id'], r['latest'],
+                                {'ip_address': r['ip_address'], 'score': score,
+                                 'total_questions': r['total_questions'], 'submitted_at': r['submitted_at']}))
+        return changed
+
+    def _write(self, changed):
+        if not changed:
+            return
+        with self.connect() as conn:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('UPDATE results SET score = ? WHERE id = ?',
+                                 ((data['score'], result_id) for result_id, _, _, data in changed))
+                record_changes(conn, RESULT, [(user_id, data) for _, user_id, latest, data in changed if latest])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _regrade(self, question_ids):
+        self.stats['jobs'] += 1
+        with self.connect() as conn:
+            start_id = self._since = latest_change_id(conn)
+            answer_key = exam_cache.get_bank(conn).answer_key
+            result_ids = self._affected(conn, question_ids)
+        self._progress(state='running', question_ids=question_ids, total=len(result_ids), processed=0, changed=0,
+                       started_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), finished_at=None)
+        logger.info(f"Regrading {len(result_ids)} submissions for questions {question_ids}")
+
+        seen = set()
+        processed = changed_count = 0
+        while result_ids:
+            changed = []
+            for i in range(0, len(result_ids), self.chunk_size):
+                chunk = result_ids[i:i + self.chunk_size]
+                with self.connect() as conn:
+                    changed.extend(self._rescore(conn, chunk, answer_key))
+                processed += len(chunk)
+                self._progress(processed=processed)
+            self._write(changed)
+            seen.update(result_ids)
+            changed_count += len(changed)
+            self._progress(changed=changed_count)
+
+            with self.connect() as conn:
+                result_ids = self._late(conn, start_id, seen)
+            if result_ids:
+                self._progress(total=processed + len(result_ids))
+
+        self._since = None
+        self.stats['regraded'] += processed
+        self.stats['changed'] += changed_count
+        with self._lock:
+            # Another edit arrived meanwhile: stay queued so the dashboard keeps watching
+            self._status.update(state='queued' if self._pending else 'done',
+                                finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        logger.info(f"Regraded {processed} submissions for questions {question_ids}; {changed_count} scores changed")
@@ -0,0 +1,185 @@
+import os
+import sys
+import glob
+import time
+import signal
+import socket
+import logging
+import argparse
+import importlib
+from config import Config
+from migrations import migrate_path
+from metrics import watch_waitress
+
+logger = logging.getLogger('serve')
+
+SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+APPS = {'student': ('app', 5000), 'admin': ('admin_app', 5001)}
+
+# A worker dying sooner than this after starting is respawned with a delay
+MIN_WORKER_LIFETIME = 5
+RESPAWN_DELAY = 1
+
+
+def listen(host, port, backlog=1024):
+    """A listening socket that other worker processes may bind as well;
+    the kernel spreads new connections across them"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def serve_app(app, **kw):
+    """waitress.serve() that also reports waitress's task queue in /metrics"""
+    from waitress import create_server
+    server = create_server(app, **kw)
+    if Config.METRICS_ENABLED:
+        watch_waitress(server)
+    server.run()
+
+
+def run_worker(worker_id, args):
+    """Body of a forked worker: import the app and serve until signalled"""
+    def stop(signum, frame):
+        # Ignore repeats so shutdown (and the write-behind flushes) can finish
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+    Config.WORKER_ID = worker_id
+    os.environ['WORKER_ID'] = str(worker_id)
+
+    sock = listen(args.host, args.port)
+    module = importlib.import_module(APPS[args.app][0])
+    logger.info(f"Worker {worker_id} (pid {os.getpid()}) serving on {args.host}:{args.port}")
+    # waitress returns once the SystemExit from stop() has drained its threads
+    serve_app(module.app, sockets=[sock], threads=args.threads)
+
+
+def orphan_journals(workers):
+    """Submission journals no worker in this configuration would replay"""
+    base = Config.SUBMISSION_JOURNAL_PATH
+    found = [base] if workers > 1 and os.path.exists(base) else []
+    for path in glob.glob(f'{glob.escape(base)}.*'):
+        suffix = path[len(base) + 1:]
+        if suffix.isdigit() and (workers == 1 or int(suffix) >= workers):
+            found.append(path)
+    return [path for path in found if os.path.getsize(path)]
+
+
+class Supervisor:
+    """Pre-fork parent: starts the workers, restarts any that die, and
+    passes SIGTERM/SIGINT on to them"""
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}
+        self.stopping = False
+
+    def spawn(self, worker_id):
+        # Held back until the child has replaced the supervisor's handlers
+        signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(worker_id, self.args)
+            except SystemExit as e:
+                code = e.code or 0
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed: {e}")
+                code = 1
+            # Leave through sys.exit so the app's atexit flushes run in this process
+            sys.exit(code)
+        self.workers[pid] = (worker_id, time.monotonic())
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+        return pid
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker_id in range(self.args.workers):
+            self.spawn(worker_id)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            worker_id, started = self.workers.pop(pid, (None, None))
+            if worker_id is None or self.stopping:
+                continue
+            logger.warning(f"Worker {worker_id} (pid {pid}) exited with status {status}; restarting")
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(RESPAWN_DELAY)
+            if not self.stopping:
+                self.spawn(worker_id)
+        logger.info("All workers stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the exam portal with several worker processes (Linux)')
+    parser.add_argument('app', nargs='?', choices=tuple(APPS), default='student')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--threads', type=int, default=8, help='waitress threads per worker (default: 8)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, help='default: 5000 for student, 5001 for admin')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(os, 'fork'):
+        raise SystemExit('Multi-process serving needs Linux; use start_servers_production.bat on Windows')
+    if args.workers < 1:
+        raise SystemExit('--workers must be at least 1')
+    if args.app == 'admin' and args.workers > 1:
+        # The live feed and leaderboard are per process, and there are only a few admins
+        raise SystemExit('The admin panel runs as a single process; use --workers 1')
+    args.port = args.port or APPS[args.app][1]
+
+    if args.app == 'student' and Config.SUBMISSION_QUEUE_ENABLED:
+        orphans = orphan_journals(args.workers)
+        if orphans:
+            raise SystemExit(f"Unreplayed submission journals: {', '.join(orphans)}. "
+                             f"Start with the worker count that wrote them so they are replayed first.")
+
+    # Fail fast if the port is taken, rather than each worker failing in turn
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    try:
+        probe.bind((args.host, args.port))
+    except OSError as e:
+        raise SystemExit(f"Cannot listen on {args.host}:{args.port}: {e}")
+    finally:
+        probe.close()
+
+    # Migrate once here so workers do not race to do it, and before any fork
+    # so no worker inherits an open SQLite connection
+    migrate_path()
+    Config.WORKERS = args.workers
+    os.environ['WORKERS'] = str(args.workers)
+
+    logger.info(f"Starting {args.workers} {args.app} workers x {args.threads} threads on {args.host}:{args.port}")
+    Supervisor(args).run()
+
+
+if __name__ == '__main__':
+    main()
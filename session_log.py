@@ -0,0 +1,99 @@
+import threading
+import logging
+from datetime import datetime
+from change_log import record_changes, SESSION
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLog:
+    """Write-behind buffer for login bookkeeping.
+
+    Logins append a user_sessions row (and its change_log entry) to memory;
+    every flush_interval seconds the buffer is written in one transaction,
+    so a hall logging in at once costs one commit per interval instead of
+    one per student. Password hash upgrades ride along in the same batch.
+    Rows carry their own login_time, so the delay does not skew the log.
+    """
+
+    def __init__(self, connect, flush_interval=1.0):
+        self.connect = connect
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._logins = []
+        self._passwords = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {'logins': 0, 'rows_written': 0, 'password_upgrades': 0, 'flushes': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='session-log-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush()
+
+    def record_login(self, user_id, ip_address):
+        login_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._logins.append((user_id, ip_address, login_time))
+            self.stats['logins'] += 1
+
+    def upgrade_password(self, user_id, old_hash, new_hash):
+        """Queue a rehash; skipped at write time if the password changed meanwhile"""
+        with self._lock:
+            self._passwords[user_id] = (old_hash, new_hash)
+
+    def _take(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                logins, self._logins = self._logins, []
+                passwords, self._passwords = self._passwords, {}
+                return logins, passwords
+            logins = [row for row in self._logins if row[0] == user_id]
+            if not logins:
+                return [], {}
+            self._logins = [row for row in self._logins if row[0] != user_id]
+            return logins, {}
+
+    def _write(self, logins, passwords):
+        if not logins and not passwords:
+            return
+        try:
+            with self.connect() as conn:
+                conn.executemany('INSERT INTO user_sessions (user_id, ip_address, login_time) VALUES (?, ?, ?)',
+                                 logins)
+                record_changes(conn, SESSION, ((uid, {'ip_address': ip, 'at': login_time})
+                                               for uid, ip, login_time in logins))
+                conn.executemany('UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                                 ((new_hash, uid, old_hash) for uid, (old_hash, new_hash) in passwords.items()))
+                conn.commit()
+        except Exception:
+            # Put everything back so the next flush retries it
+            with self._lock:
+                self._logins[:0] = logins
+                for uid, hashes in passwords.items():
+                    self._passwords.setdefault(uid, hashes)
+            raise
+        self.stats['rows_written'] += len(logins)
+        self.stats['password_upgrades'] += len(passwords)
+
+    def flush(self):
+        self.stats['flushes'] += 1
+        self._write(*self._take())
+
+    def flush_user(self, user_id):
+        """Write a user's pending logins now (logout must see its session row)"""
+        self._write(*self._take(user_id))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Session log flush error: {e}")
@@ -0,0 +1,209 @@
+import json
+import time
+import secrets
+import threading
+import logging
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from change_log import record_changes, LOGOUT
+
+logger = logging.getLogger(__name__)
+
+# A user_sessions row younger than this is never closed by the sweeper; its
+# web session may still be on its way to the database
+OPEN_LOG_GRACE = 60
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.modified = False
+
+
+class SessionStore:
+    """Server-side sessions in web_sessions with an in-memory hot tier.
+
+    Session data is written through (it only changes at login and logout);
+    the sliding expiry is kept in memory and written by the sweeper, which
+    also deletes expired sessions and closes their user_sessions log rows.
+    Memory entries are re-read after hot_ttl seconds so a logout handled by
+    another process is noticed.
+    """
+
+    def __init__(self, connect, lifetime, sweep_interval=30, hot_ttl=5):
+        self.connect = connect
+        self.lifetime = lifetime
+        self.sweep_interval = sweep_interval
+        self.hot_ttl = hot_ttl
+
+        self._lock = threading.Lock()
+        self._hot = {}
+        self._touched = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {'hits': 0, 'loads': 0, 'saves': 0, 'deletes': 0, 'expired': 0, 'sweeps': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='session-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._flush_touches()
+
+    def get(self, sid):
+        now = time.time()
+        with self._lock:
+            entry = self._hot.get(sid)
+            if entry is not None and now - entry[1] < self.hot_ttl and entry[2] > now:
+                self.stats['hits'] += 1
+                return entry[0]
+
+        with self.connect() as conn:
+            row = conn.execute('SELECT data, expires_at FROM web_sessions WHERE sid = ?', (sid,)).fetchone()
+        with self._lock:
+            self.stats['loads'] += 1
+            # Keep the later expiry: this process may have seen newer activity
+            expires_at = row and max(row['expires_at'], self._touched.get(sid, 0) + self.lifetime)
+            if row is None or expires_at <= now:
+                self._hot.pop(sid, None)
+                return None
+            data = json.loads(row['data'])
+            self._hot[sid] = (data, now, expires_at)
+            return data
+
+    def save(self, sid, data, user_id, ip_address):
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute('''INSERT OR REPLACE INTO web_sessions
+                            (sid, user_id, ip_address, data, created_at, last_seen, expires_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         (sid, user_id, ip_address, json.dumps(data), now, now, now + self.lifetime))
+            conn.commit()
+        with self._lock:
+            self._hot[sid] = (data, now, now + self.lifetime)
+            self.stats['saves'] += 1
+
+    def delete(self, sid):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM web_sessions WHERE sid = ?', (sid,))
+            conn.commit()
+        with self._lock:
+            self._hot.pop(sid, None)
+            self._touched.pop(sid, None)
+            self.stats['deletes'] += 1
+
+    def touch(self, sid):
+        """Slide a session's expiry; written to the database by the sweeper"""
+        now = time.time()
+        with self._lock:
+            self._touched[sid] = now
+            entry = self._hot.get(sid)
+            if entry is not None:
+                self._hot[sid] = (entry[0], entry[1], now + self.lifetime)
+
+    def new_sid(self):
+        return secrets.token_urlsafe(32)
+
+    def _flush_touches(self):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        try:
+            with self.connect() as conn:
+                conn.executemany('''UPDATE web_sessions SET last_seen = ?, expires_at = ?
+                                    WHERE sid = ? AND expires_at < ?''',
+                                 ((seen, seen + self.lifetime, sid, seen + self.lifetime)
+                                  for sid, seen in touched.items()))
+                conn.commit()
+        except Exception:
+            with self._lock:
+                for sid, seen in touched.items():
+                    self._touched[sid] = max(seen, self._touched.get(sid, 0))
+            raise
+
+    def sweep(self):
+        """Write pending expiry updates, drop expired sessions and close their log rows"""
+        self.stats['sweeps'] += 1
+        self._flush_touches()
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            expired = conn.execute('DELETE FROM web_sessions WHERE expires_at <= ?', (now,)).rowcount
+            closed = [r[0] for r in conn.execute('''SELECT DISTINCT s.user_id FROM user_sessions s
+                                                   WHERE s.is_active = 1
+                                                   AND s.login_time < datetime('now', 'localtime', ?)
+                                                   AND NOT EXISTS (SELECT 1 FROM web_sessions w
+                                                                   WHERE w.user_id = s.user_id)''',
+                                                (f'-{OPEN_LOG_GRACE} seconds',))]
+            conn.executemany('''UPDATE user_sessions SET is_active = 0, logout_time = datetime('now', 'localtime')
+                                WHERE user_id = ? AND is_active = 1''', ((uid,) for uid in closed))
+            record_changes(conn, LOGOUT, ((uid, {}) for uid in closed))
+            conn.commit()
+
+        with self._lock:
+            for sid in [sid for sid, entry in self._hot.items() if entry[2] <= now]:
+                del self._hot[sid]
+            self.stats['expired'] += expired
+        if expired or closed:
+            logger.info(f"Session sweep: {expired} expired, {len(closed)} log entries closed")
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Session sweep error: {e}")
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface storing only a random session id in the cookie"""
+
+    def __init__(self, store, client_ip=None):
+        self.store = store
+        # Called inside the request to label saved sessions with an address
+        self.client_ip = client_ip
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            # New contents always get a new id (login regenerates the session)
+            if session.sid:
+                self.store.delete(session.sid)
+            session.sid = self.store.new_sid()
+            self.store.save(session.sid, dict(session), session.get('user_id'),
+                            self.client_ip() if self.client_ip else None)
+        else:
+            self.store.touch(session.sid)
+
+        if session.modified or self.should_set_cookie(app, session):
+            response.set_cookie(name, session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app),
+                                domain=domain, path=path)
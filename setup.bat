@@ -15,6 +15,7 @@ echo DB_PATH=exam.db >> .env.tmp
 echo SESSION_LIFETIME=3600 >> .env.tmp
 echo MAX_LOGIN_ATTEMPTS=5 >> .env.tmp
 echo RATE_LIMIT_WINDOW=60 >> .env.tmp
+echo MAX_LOGIN_ATTEMPTS_PER_IP=20 >> .env.tmp
 
 if exist .env (
     echo .env file already exists. Backup created as .env.backup
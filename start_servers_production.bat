@@ -36,8 +36,8 @@ echo Optimized for 150+ concurrent users
 echo Press Ctrl+C to stop servers
 echo.
 
-start "Student Portal (Production)" cmd /k py -c "from waitress import serve; from app import app; print('Student Portal running on port 5000 (8 threads)'); serve(app, host='0.0.0.0', port=5000, threads=8)"
-start "Admin Panel (Production)" cmd /k py -c "from waitress import serve; from admin_app import app; print('Admin Panel running on port 5001 (4 threads)'); serve(app, host='0.0.0.0', port=5001, threads=4)"
+start "Student Portal (Production)" cmd /k py -c "from serve import serve_app; from app import app; print('Student Portal running on port 5000 (8 threads)'); serve_app(app, host='0.0.0.0', port=5000, threads=8)"
+start "Admin Panel (Production)" cmd /k py -c "from serve import serve_app; from admin_app import app; print('Admin Panel running on port 5001 (8 threads)'); serve_app(app, host='0.0.0.0', port=5001, threads=8)"
 
 echo Both servers started in production mode!
 pause
@@ -0,0 +1,175 @@
+import io
+import os
+import csv
+import json
+import sqlite3
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+from passwords import hash_password
+from question_cache import bump_version, USERS
+
+FORMATS = ('csv', 'json')
+
+# Refuse uploads with more rows than this
+MAX_IMPORT_ROWS = 10000
+# Below this many passwords, starting worker processes costs more than it saves
+PARALLEL_HASH_MIN = 16
+# SQLite caps the number of bound parameters per statement
+LOOKUP_CHUNK = 500
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash a list of passwords, spreading large batches over a process pool"""
+    if workers == 1 or len(passwords) < PARALLEL_HASH_MIN:
+        return [hash_password(p) for p in passwords]
+    workers = workers or os.cpu_count() or 1
+    # Spawn, not fork: forking a threaded server can copy a lock some other
+    # thread holds (logging, the connection pool) into a child that then deadlocks.
+    # Each spawned worker re-imports __main__ (admin_app under `py admin_app.py`),
+    # which is why admin_app touches the database only from start_background()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(hash_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def _clean(value, max_length):
+    if not value or not isinstance(value, str):
+        return None
+    return value.strip()[:max_length] or None
+
+
+def _record_fields(record):
+    if not isinstance(record, dict):
+        return None, None
+    return record.get('username'), record.get('password')
+
+
+def parse_csv(stream):
+    """Yield (line, username, password) from a username,password CSV; a header row is optional"""
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    try:
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            if reader.line_num == 1 and [c.strip().lower() for c in row[:2]] == ['username', 'password']:
+                continue
+            yield reader.line_num, row[0], row[1] if len(row) > 1 else None
+    except csv.Error as e:
+        raise ValueError(f'Invalid CSV on line {reader.line_num}: {e}')
+
+
+def parse_json(stream):
+    """Yield (line, username, password) from NDJSON, or from a JSON array of objects.
+
+    NDJSON is parsed a line at a time; an array has to be read whole, so its
+    "line" numbers are 1-based positions in the array instead.
+    """
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    for line_no, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith('['):
+            try:
+                records = json.loads(line + lines.read())
+            except ValueError:
+                raise ValueError('Invalid JSON')
+            if not isinstance(records, list):
+                raise ValueError('Invalid JSON')
+            for position, record in enumerate(records, 1):
+                yield (position,) + _record_fields(record)
+            return
+        try:
+            record = json.loads(stripped)
+        except ValueError:
+            record = None
+        yield (line_no,) + _record_fields(record)
+
+
+def parse_upload(stream, fmt):
+    if fmt not in FORMATS:
+        raise ValueError('Unsupported format')
+    return parse_csv(stream) if fmt == 'csv' else parse_json(stream)
+
+
+def existing_usernames(conn, usernames):
+    found = set()
+    for i in range(0, len(usernames), LOOKUP_CHUNK):
+        chunk = usernames[i:i + LOOKUP_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        found.update(r[0] for r in conn.execute(f'SELECT username FROM users WHERE username IN ({placeholders})',
+                                                chunk))
+    return found
+
+
+def import_students(conn, records, workers=None):
+    """Create students from (line, username, password) records in one transaction.
+
+    Invalid rows and usernames that already exist (in the database or
+    earlier in the same upload) are reported per line and skipped; the
+    rest of the batch is still imported. Returns the report dict.
+    """
+    skipped = []
+    pending = []
+    seen = set()
+    for count, (line_no, username, password) in enumerate(records, 1):
+        if count > MAX_IMPORT_ROWS:
+            raise ValueError(f'Too many rows (limit {MAX_IMPORT_ROWS})')
+        username = _clean(username, 50)
+        password = _clean(password, 100)
+        if not username or not password:
+            skipped.append({'line': line_no, 'username': username, 'message': 'Invalid input'})
+        elif username in seen:
+            skipped.append({'line': line_no, 'username': username, 'message': 'Duplicate username in upload'})
+        else:
+            seen.add(username)
+            pending.append((line_no, username, password))
+
+    # Check before hashing so conflicting rows cost nothing, then again
+    # under the write lock in case another admin added the same name
+    taken = existing_usernames(conn, [username for _, username, _ in pending])
+    to_hash = [p for p in pending if p[1] not in taken]
+    hashes = hash_passwords([password for _, _, password in to_hash], workers)
+
+    conn.execute('BEGIN IMMEDIATE')
+    taken |= existing_usernames(conn, [username for _, username, _ in to_hash])
+    rows = [(username, password_hash, 'student')
+            for (_, username, _), password_hash in zip(to_hash, hashes) if username not in taken]
+    conn.executemany('INSERT INTO users (username, password, role) VALUES (?, ?, ?)', rows)
+    if rows:
+        bump_version(conn, USERS)
+
+    skipped.extend({'line': line_no, 'username': username, 'message': 'Username already exists'}
+                   for line_no, username, _ in pending if username in taken)
+    skipped.sort(key=lambda s: s['line'])
+    return {'created': len(rows), 'skipped': skipped}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk-create student accounts from a CSV or JSON file')
+    parser.add_argument('file', help='CSV (username,password) or JSON/NDJSON with username and password fields')
+    parser.add_argument('--format', choices=FORMATS, help='default: from the file extension')
+    parser.add_argument('--workers', type=int, help='hashing processes (default: CPU count)')
+    parser.add_argument('--db', help=f'database path (default: {Config.DB_PATH})')
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('json' if os.path.splitext(args.file)[1].lower() in ('.json', '.ndjson') else 'csv')
+    conn = sqlite3.connect(args.db or Config.DB_PATH)
+    try:
+        with open(args.file, 'rb') as f:
+            report = import_students(conn, parse_upload(f, fmt), args.workers)
+        conn.commit()
+    except ValueError as e:
+        conn.rollback()
+        raise SystemExit(f"Import failed: {e}")
+    finally:
+        conn.close()
+
+    for s in report['skipped']:
+        print(f"Line {s['line']}: {s['username'] or '-'}: {s['message']}")
+    print(f"Created {report['created']} students, skipped {len(report['skipped'])}")
+
+
+if __name__ == '__main__':
+    main()
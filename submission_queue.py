@@ -0,0 +1,245 @@
+import os
+import json
+import queue
+import threading
+import time
+import uuid
+import logging
+from datetime import datetime
+from exams import delete_exam
+from answer_drafts import delete_drafts
+from answer_sheets import save_answers
+from change_log import record_change, RESULT
+
+logger = logging.getLogger(__name__)
+
+
+class SubmissionQueue:
+    """Write-behind queue that absorbs the end-of-exam submission burst.
+
+    submit() appends the graded submission to an append-only journal and
+    fsyncs it before returning, so an acknowledged submission survives a
+    crash. A single writer thread drains the queue into answer_sheets, results
+    and users in group-committed batches. On start the journal is replayed;
+    replay is idempotent because each batch only applies submissions whose
+    user is not yet marked as attempted. The journal is truncated whenever
+    everything written to it has been committed.
+
+    With several worker processes each passes its worker id: journals get
+    a per-worker suffix, and a pending submission is claimed in the
+    submission_claims table so every worker sees it. A worker restarted
+    with the same id replays its journal and then drops its stale claims.
+    """
+
+    def __init__(self, connect, journal_path, batch_size=50, flush_interval=0.2, worker=None):
+        self.connect = connect
+        self.worker = worker
+        self.journal_path = journal_path if worker is None else f'{journal_path}.{worker}'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue()
+        self._journal_lock = threading.Lock()
+        self._journal = None
+        self._journaled = 0
+        self._committed = 0
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {'submitted': 0, 'written': 0, 'duplicates': 0, 'batches': 0, 'replayed': 0, 'errors': 0}
+
+    def start(self):
+        self._replay()
+        if self.worker is not None:
+            # Claims not backed by a journal line were never acknowledged
+            with self.connect() as conn:
+                conn.execute('DELETE FROM submission_claims WHERE worker = ?', (self.worker,))
+                conn.commit()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='submission-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._journal:
+            self._journal.close()
+
+    def is_pending(self, user_id, conn=None):
+        with self._pending_lock:
+            if user_id in self._pending:
+                return True
+        if self.worker is None:
+            return False
+        if conn is not None:
+            return self._claimed(conn, user_id)
+        with self.connect() as conn:
+            return self._claimed(conn, user_id)
+
+    def _claimed(self, conn, user_id):
+        return conn.execute('SELECT 1 FROM submission_claims WHERE user_id = ?', (user_id,)).fetchone() is not None
+
+    def _claim(self, user_id, receipt, conn=None):
+        if conn is None:
+            with self.connect() as conn:
+                return self._claim(user_id, receipt, conn)
+        claimed = conn.execute('INSERT OR IGNORE INTO submission_claims (user_id, worker, receipt) VALUES (?, ?, ?)',
+                               (user_id, self.worker, receipt)).rowcount
+        conn.commit()
+        return bool(claimed)
+
+    def _release(self, user_id, conn=None):
+        if conn is None:
+            with self.connect() as conn:
+                return self._release(user_id, conn)
+        conn.execute('DELETE FROM submission_claims WHERE user_id = ? AND worker = ?', (user_id, self.worker))
+        conn.commit()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, user_id, ip_address, grade, conn=None):
+        """Durably record a graded submission and return its receipt id.
+
+        Returns None if the user already has a submission waiting to be
+        written. Pass conn when the caller already holds a pooled connection.
+        """
+        with self._pending_lock:
+            if user_id in self._pending:
+                return None
+            self._pending.add(user_id)
+
+        receipt = uuid.uuid4().hex
+        if self.worker is not None and not self._claim(user_id, receipt, conn):
+            # Another worker holds this user's submission
+            with self._pending_lock:
+                self._pending.discard(user_id)
+            return None
+
+        record = {
+            'receipt': receipt,
+            'user_id': user_id,
+            'ip_address': ip_address,
+            'final_score': grade.final_score,
+            'total': grade.total,
+            'answer_rows': grade.answer_rows,
+            'submitted_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+
+        try:
+            with self._journal_lock:
+                self._journal.write(line)
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journaled += 1
+        except Exception:
+            with self._pending_lock:
+                self._pending.discard(user_id)
+            if self.worker is not None:
+                self._release(user_id, conn)
+            raise
+
+        self.stats['submitted'] += 1
+        self._queue.put(record)
+        return record['receipt']
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        records = []
+        with open(self.journal_path, encoding='utf-8') as f:
+            for lineno, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A torn final line means the request was never acknowledged
+                    logger.warning(f"Skipping unreadable journal line {lineno} in {self.journal_path}")
+
+        if records:
+            logger.info(f"Replaying {len(records)} journaled submissions")
+            for i in range(0, len(records), self.batch_size):
+                self._write_batch(records[i:i + self.batch_size])
+            self.stats['replayed'] = len(records)
+        os.remove(self.journal_path)
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+
+            # Give the rest of a burst a moment to arrive, then commit it together
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            while True:
+                try:
+                    self._write_batch(batch)
+                    break
+                except Exception as e:
+                    # Never drop acknowledged submissions; they stay journaled until written
+                    self.stats['errors'] += 1
+                    logger.error(f"Submission batch write failed, retrying: {e}")
+                    time.sleep(1)
+
+            with self._pending_lock:
+                for record in batch:
+                    self._pending.discard(record['user_id'])
+            self._maybe_truncate(len(batch))
+
+    def _write_batch(self, batch):
+        written = 0
+        with self.connect() as conn:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for record in batch:
+                    marked = conn.execute('UPDATE users SET attempted = 1 WHERE id = ? AND attempted = 0',
+                                          (record['user_id'],)).rowcount
+                    if not marked:
+                        self.stats['duplicates'] += 1
+                        continue
+                    result_id = conn.execute('''INSERT INTO results (user_id, ip_address, score, total_questions, submitted_at)
+                                                 VALUES (?, ?, ?, ?, ?)''',
+                                             (record['user_id'], record['ip_address'], record['final_score'],
+                                              record['total'], record['submitted_at'])).lastrowid
+                    save_answers(conn, result_id, record['user_id'], record['answer_rows'])
+                    record_change(conn, RESULT, record['user_id'], ip_address=record['ip_address'],
+                                  score=record['final_score'], total_questions=record['total'],
+                                  submitted_at=record['submitted_at'])
+                    delete_drafts(conn, record['user_id'])
+                    delete_exam(conn, record['user_id'])
+                    written += 1
+                if self.worker is not None:
+                    conn.executemany('DELETE FROM submission_claims WHERE user_id = ?',
+                                     ((record['user_id'],) for record in batch))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        self.stats['batches'] += 1
+        self.stats['written'] += written
+        logger.info(f"Wrote {written} queued submissions in one batch")
+
+    def _maybe_truncate(self, count):
+        with self._journal_lock:
+            self._committed += count
+            if self._committed == self._journaled:
+                self._journal.truncate(0)
+                self._journal.seek(0)
+                self._journaled = self._committed = 0
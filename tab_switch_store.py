@@ -0,0 +1,137 @@
+import threading
+import logging
+from change_log import record_changes, TAB_SWITCH
+
+logger = logging.getLogger(__name__)
+
+
+class TabSwitchStore:
+    """In-memory max tab-switch count per user with coalesced flushes.
+
+    Events only update memory. Every flush_interval seconds each user whose
+    count went up since the last flush gets one tab_switches row carrying
+    the new maximum, so the audit trail records each escalation window
+    instead of every focus change. Counts for users not seen since startup
+    are loaded from the table on first access.
+
+    With shared=True (several worker processes) a user's events may land on
+    any worker, so rises are written through and get() always reads the
+    table, keeping the penalty at submit time exact.
+    """
+
+    def __init__(self, connect, flush_interval=5.0, shared=False):
+        self.connect = connect
+        self.flush_interval = flush_interval
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._dirty = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {'events': 0, 'rows_written': 0, 'flushes': 0, 'loads': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='tab-switch-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _load(self, user_id, conn=None):
+        if conn is None:
+            with self.connect() as conn:
+                return self._load(user_id, conn)
+        row = conn.execute('SELECT MAX(switch_count) FROM tab_switches WHERE user_id = ?',
+                           (user_id,)).fetchone()
+        self.stats['loads'] += 1
+        return row[0] or 0
+
+    def get(self, user_id, conn=None):
+        """Current max count; pass conn when already holding a pooled connection"""
+        with self._lock:
+            count = self._counts.get(user_id)
+        if count is not None and not self.shared:
+            return count
+
+        count = self._load(user_id, conn)
+        with self._lock:
+            # An event may have arrived while loading; keep the larger value
+            count = max(count, self._counts.get(user_id, 0))
+            self._counts[user_id] = count
+        return count
+
+    def record(self, user_id, ip_address, count):
+        """Record a client-reported cumulative switch count, returning the current max"""
+        current = self.get(user_id)
+        with self._lock:
+            self.stats['events'] += 1
+            current = max(current, self._counts.get(user_id, 0))
+            if count > current:
+                self._counts[user_id] = count
+                self._dirty[user_id] = (ip_address, count)
+                current = count
+        if self.shared:
+            self.flush_user(user_id)
+        return current
+
+    def _take(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                dirty, self._dirty = self._dirty, {}
+                return [(uid, ip, count) for uid, (ip, count) in dirty.items()]
+            if user_id in self._dirty:
+                ip, count = self._dirty.pop(user_id)
+                return [(user_id, ip, count)]
+            return []
+
+    def _insert(self, conn, rows):
+        conn.executemany('INSERT INTO tab_switches (user_id, ip_address, switch_count) VALUES (?, ?, ?)', rows)
+        record_changes(conn, TAB_SWITCH,
+                       ((uid, {'ip_address': ip, 'max_switches': count}) for uid, ip, count in rows))
+        conn.commit()
+
+    def _write(self, rows, conn=None):
+        if not rows:
+            return
+        try:
+            if conn is None:
+                with self.connect() as conn:
+                    self._insert(conn, rows)
+            else:
+                self._insert(conn, rows)
+        except Exception:
+            # Put the rows back so the next flush retries them
+            with self._lock:
+                for uid, ip, count in rows:
+                    if uid not in self._dirty or self._dirty[uid][1] < count:
+                        self._dirty[uid] = (ip, count)
+            raise
+        self.stats['rows_written'] += len(rows)
+
+    def flush(self):
+        self.stats['flushes'] += 1
+        self._write(self._take())
+
+    def flush_user(self, user_id, conn=None):
+        """Write a user's pending count immediately (used at submit time).
+
+        Pass the caller's connection when it already holds one: a second
+        checkout from the pool per request can exhaust it under load.
+        """
+        self._write(self._take(user_id), conn)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._counts.pop(user_id, None)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Tab switch flush error: {e}")